@@ -1,11 +1,29 @@
 import pandas as pd
+import os
 import json
+import signal
+import argparse
 from datetime import date
-from tools.Extractor import Reddit_Extractor, Ticker_Extractor
-from tools.Stock_Dictionary import get_dict
+from tools.Extractor import Reddit_Extractor, Ticker_Extractor, Comment_Budget, Scrape_State, ARROW_SCHEMA
+from tools.Parquet_Stream import Parquet_Stream_Writer, compact_parts, append_table
+from tools.Stock_Dictionary import get_dict_matcher
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+parser = argparse.ArgumentParser(description = 'Scrape the daily posts and comments and store them in parquet.')
+parser.add_argument('--stream', action = 'store_true',
+                    help = 'write rows to the parquet file while scraping instead of building the whole frame first')
+parser.add_argument('--row-group-size', type = int, default = 1000, help = 'rows per flushed row group in --stream mode')
+parser.add_argument('--comment-depth', type = int, default = 0, help = 'deepest reply level kept, 0 keeps only top level comments')
+parser.add_argument('--comment-limit', type = int, default = 5, help = 'comments requested with each post')
+parser.add_argument('--max-comments', type = int, default = None, help = 'comments kept per post')
+parser.add_argument('--more-requests', type = int, default = None, help = 'requests all posts together may spend on expanding "load more comments"')
+parser.add_argument('--more-seconds', type = float, default = None, help = 'seconds after which no more comments are expanded')
+parser.add_argument('--state', default = '.\\data\\scrape_state.json',
+                    help = 'posts and comments collected by earlier runs, they are not fetched or stored again')
+parser.add_argument('--full', action = 'store_true', help = 'ignore the state and fetch everything')
+args = parser.parse_args()
+
 
 #normally, we would have made the credentials relative, and leave them in .gitignore
 #however Reddit requires a Dev enabled account, so we created one just for this purpose
@@ -13,22 +31,67 @@ import pyarrow.parquet as pq
 with open(".\\data\\credentials.json") as json_file:
     creds = json.load(json_file)     
 
-extr = Reddit_Extractor(creds)
-stock_dictionary = get_dict()
-tickerExtr = Ticker_Extractor(stock_dictionary)
+budget = None
+if args.more_requests is not None or args.more_seconds is not None:
+    budget = Comment_Budget(seconds = args.more_seconds, requests = args.more_requests)
+extr = Reddit_Extractor(creds, comment_limit = args.comment_limit, comment_depth = args.comment_depth,
+                        max_comments = args.max_comments, comment_budget = budget,
+                        state = None if args.full else Scrape_State(args.state))
+stock_dictionary, matcher = get_dict_matcher()
+tickerExtr = Ticker_Extractor(stock_dictionary, matcher)
 subreddits = ["stocks","investing","StockMarket","wallstreetbets"]
 
+today = date.today()
+stringEpoch = today.strftime("%d_%m_%y")
+folder = '.\\data\\daily_parquet_data\\'
+path_tsv = folder + stringEpoch + ".parquet"
+
+#with the state, a second run on the same day stores only the rows the first did not, so they are added to the day's file
+append = extr.state is not None
+
+#row groups of --stream runs killed before they could close, today's are continued by the writer below
+#added to the day's file, it may hold the rows of an earlier run of that day
+for leftover in sorted(f for f in os.listdir(folder) if f.endswith('.parquet.parts')):
+    if leftover != stringEpoch + '.parquet.parts':
+        print("Recovered", compact_parts(os.path.join(folder, leftover[:-len('.parts')]), append = True), "rows of", leftover)
+
+if args.stream:
+    #tickers are tagged a row group at a time, right before it is flushed
+    def tag_columns(columns):
+        tickers, mentions = tickerExtr.tag_batch(columns['text'], mentions = True)
+        columns['tickers'] = tickers.to_pylist()
+        columns['mentions'] = mentions.to_pylist()
+        return columns
+
+    #a kill lets the writer close the file, a hard kill leaves the flushed row groups as parts (see Parquet_Stream.py)
+    def stop(signum, frame):
+        raise SystemExit(1)
+    signal.signal(signal.SIGTERM, stop)
+
+    with Parquet_Stream_Writer(path_tsv, ARROW_SCHEMA, row_group_size = args.row_group_size, prepare = tag_columns,
+                               append = append) as writer:
+        for record in extr.iterRecords(subreddits = subreddits, limit = 100):
+            writer.write(record)
+    print("Stored", writer.written, "rows in", path_tsv)
+    if extr.state is not None:
+        extr.state.save()
+    raise SystemExit(0)
+
 #load posts
 main_df = extr.joinData(subreddits = subreddits,limit = 100)
-main_df['tickers'] = main_df['text'].apply(tickerExtr.tickerCounter)
+tickers, mentions = tickerExtr.tag_batch(main_df['text'], mentions = True)
+main_df['tickers'] = tickers.to_pylist()
+main_df['mentions'] = mentions.to_pylist() #how often and where each ticker is mentioned
 
 #observe dataframe
 main_df.tickers[main_df.tickers.notna()].tolist()
 main_df['subreddit'].value_counts()
 
 #store object in parquet format
-today = date.today()
-stringEpoch = today.strftime("%d_%m_%y")
-path_tsv = '.\\data\\daily_parquet_data\\' + stringEpoch + ".parquet"
-table_pa = pa.Table.from_pandas(main_df)
-pq.write_table(table_pa, path_tsv)
\ No newline at end of file
+table_pa = pa.Table.from_pandas(main_df, schema = ARROW_SCHEMA)
+if append:
+    append_table(path_tsv, table_pa)
+else:
+    pq.write_table(table_pa, path_tsv)
+if extr.state is not None: #only once the data is stored
+    extr.state.save()
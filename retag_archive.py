@@ -0,0 +1,72 @@
+import os
+import time
+import argparse
+import tempfile
+from multiprocessing import Pool
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tools.Extractor import Ticker_Extractor, MENTIONS_TYPE
+from tools.Stock_Dictionary import get_dict_matcher
+
+#recomputes the tickers and mentions columns of every stored daily file, used after the stock dictionary changes
+#files are spread over a process pool, each one is streamed batch by batch and replaced atomically
+
+tickerExtr = None #one compiled matcher per worker process
+
+def init_worker(stock_dictionary, matcher):
+    global tickerExtr
+    tickerExtr = Ticker_Extractor(stock_dictionary, matcher)
+
+def retag_file(path, batch_size = 10000):
+    start = time.time()
+    rows = 0
+    #temporary file in the same folder, so that os.replace is an atomic rename
+    handle, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.', suffix = '.tmp')
+    os.close(handle)
+    try:
+        #the reader is closed before the replace, windows does not rename over an open file
+        with pq.ParquetFile(path) as parquet_file:
+            schema = parquet_file.schema_arrow
+            #tickers and mention counts are replaced, or added to files written before they existed
+            fields = [pa.field('tickers', pa.list_(pa.string())), pa.field('mentions', MENTIONS_TYPE)]
+            for field in fields:
+                if field.name in schema.names:
+                    schema = schema.set(schema.get_field_index(field.name), field)
+                else:
+                    schema = schema.append(field)
+            with pq.ParquetWriter(tmp_path, schema) as writer:
+                for batch in parquet_file.iter_batches(batch_size = batch_size):
+                    table = pa.Table.from_batches([batch])
+                    for field, column in zip(fields, tickerExtr.tag_batch(table['text'], mentions = True)):
+                        if field.name in table.column_names:
+                            table = table.set_column(table.column_names.index(field.name), field, column)
+                        else:
+                            table = table.append_column(field, column)
+                    writer.write_table(table.cast(schema))
+                    rows += table.num_rows
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return os.path.basename(path), rows, time.time() - start
+
+def retag_archive(path, processes = None):
+    files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                   if f.endswith('.parquet') and os.path.isfile(os.path.join(path, f)))
+    stock_dictionary, matcher = get_dict_matcher()
+    start = time.time()
+    total_rows = 0
+    with Pool(processes = processes or os.cpu_count(), initializer = init_worker, initargs = (stock_dictionary, matcher)) as pool:
+        for name, rows, elapsed in pool.imap_unordered(retag_file, files):
+            total_rows += rows
+            print(f'{name}: {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)')
+    elapsed = time.time() - start
+    print(f'Retagged {len(files)} files, {total_rows} rows in {elapsed:.2f}s ({total_rows / max(elapsed, 1e-9):.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Recompute the tickers column of the stored daily parquet files.')
+    parser.add_argument('--path', default = './data/daily_parquet_data/')
+    parser.add_argument('--processes', type = int, default = None, help = 'defaults to the number of cores')
+    args = parser.parse_args()
+    retag_archive(args.path, args.processes)
@@ -0,0 +1,31 @@
+import json
+import signal
+import argparse
+from tools.Extractor import Reddit_Extractor, Ticker_Extractor
+from tools.Mention_Stream import Mention_Stream, replay_records
+from tools.Stock_Dictionary import get_dict_matcher
+
+#long running alternative to daily_scraper.py, follows every new post and comment of the subreddits
+#and keeps per-minute and per-hour mention counts, everything is checkpointed to parquet in --path
+parser = argparse.ArgumentParser(description = 'Stream new posts and comments and count ticker mentions in near real time.')
+parser.add_argument('--subreddits', nargs = '+', default = ["stocks","investing","StockMarket","wallstreetbets"])
+parser.add_argument('--path', default = './data/stream_parquet_data/')
+parser.add_argument('--checkpoint-every', type = float, default = 300, help = 'seconds between parquet checkpoints')
+parser.add_argument('--queue-size', type = int, default = 10000, help = 'records waiting to be tagged before reading pauses')
+parser.add_argument('--replay', nargs = '+', default = None, metavar = 'PARQUET',
+                    help = 'process stored parquet files as a recorded stream instead of connecting to Reddit')
+args = parser.parse_args()
+
+if args.replay:
+    source = replay_records(args.replay)
+else:
+    with open(".\\data\\credentials.json") as json_file:
+        creds = json.load(json_file)
+    source = Reddit_Extractor(creds).streamRecords(subreddits = args.subreddits)
+
+stream = Mention_Stream(source, Ticker_Extractor(*get_dict_matcher()), args.path,
+                        queue_size = args.queue_size, checkpoint_every = args.checkpoint_every)
+#ctrl+c or a kill finishes the current batch and writes a last checkpoint
+signal.signal(signal.SIGINT, lambda signum, frame: stream.stop())
+signal.signal(signal.SIGTERM, lambda signum, frame: stream.stop())
+print("Processed", stream.run(), "records")
@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from tools.Extractor import Rate_Limiter, Reddit_Extractor
+
+
+class Fake_Submission:
+    '''Stands in for a praw submission, loading its comments is one request through the shared limiter.'''
+    def __init__(self, reddit, id):
+        self.reddit = reddit
+        self.id = id
+
+    @property
+    def comments(self):
+        self.reddit.request()
+        subreddit = SimpleNamespace(display_name = self.id.split('_')[0])
+        return [SimpleNamespace(id = self.id + '_c' + str(i), subreddit = subreddit, created_utc = 1620000000 + i,
+                                body = 'comment ' + str(i) + ' on AAPL', replies = []) for i in range(3)]
+
+
+class Fake_Subreddit:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.name = name
+
+    def hot(self, limit):
+        self.reddit.request()
+        subreddit = SimpleNamespace(display_name = self.name)
+        return [SimpleNamespace(id = self.name + '_' + str(i), subreddit = subreddit, created_utc = 1620000000 + i,
+                                title = 'Post ' + str(i), selftext = ' about TSLA', num_comments = i % 4)
+                for i in range(limit)]
+
+
+class Fake_Reddit:
+    '''praw.Reddit replacement recording when every request was made.'''
+    def __init__(self, rate_limiter, log):
+        self.rate_limiter = rate_limiter
+        self.log = log
+
+    def request(self):
+        self.rate_limiter.acquire()
+        self.log.append(time.monotonic())
+        time.sleep(0.01) #network latency, overlaps between threads
+
+    def subreddit(self, name):
+        return Fake_Subreddit(self, name)
+
+    def submission(self, id):
+        return Fake_Submission(self, id)
+
+
+class Fake_Extractor(Reddit_Extractor):
+    def connect(self):
+        if not hasattr(self, 'log'):
+            self.log = []
+        return Fake_Reddit(self.rate_limiter, self.log)
+
+
+def most_in_a_window(log, period):
+    return max(sum(1 for moment in log if start <= moment < start + period) for start in log)
+
+
+def test_rate_limiter_caps_the_rate_of_all_threads():
+    limiter = Rate_Limiter(requests = 10, period = 0.5, burst = 2) #bursts of 2, then 16 requests a second
+    log = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers = 4) as pool:
+        list(pool.map(lambda i: (limiter.acquire(), log.append(time.monotonic())), range(30)))
+    assert 1.7 <= time.monotonic() - start < 3
+    assert most_in_a_window(sorted(log), 0.5 - 0.02) <= 10 #the budget holds from the first request on
+
+
+def test_threaded_extraction_matches_sequential():
+    subreddits = ['stocks', 'investing', 'wallstreetbets']
+    sequential = Fake_Extractor({}, max_workers = 1).joinData(subreddits, limit = 12)
+    threaded = Fake_Extractor({}, max_workers = 8).joinData(subreddits, limit = 12)
+    assert len(sequential) == 3 * 12 * 4
+    assert threaded.equals(sequential)
+
+
+def test_threaded_extraction_stays_inside_the_shared_budget():
+    extractor = Fake_Extractor({}, max_workers = 8, rate_limiter = Rate_Limiter(requests = 5, period = 0.25, burst = 2))
+    extractor.joinData(['stocks', 'investing'], limit = 10)
+    log = sorted(extractor.log)
+    assert len(log) == 2 + 2 * 10
+    #a burst of 2, then 12 a second: request k is made (k - 2) / 12 seconds after the first at the earliest
+    for k, moment in enumerate(log[2:], start = 2):
+        assert moment - log[0] >= (k - 2) / 12 - 0.01
+    assert most_in_a_window(log, 0.25 - 0.02) <= 5
@@ -0,0 +1,110 @@
+import os
+import re
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tools.Extractor import MENTIONS_TYPE
+from tools.Mention_Stream import Mention_Stream, Rolling_Counter
+
+
+class Fake_Ticker_Extractor:
+    '''Tags the words of the texts that are known tickers, optionally waiting for release before every batch.'''
+    def __init__(self, tickers = ('AAPL', 'TSLA', 'GME'), release = None):
+        self.tickers = set(tickers)
+        self.release = release
+        self.batches = 0
+
+    def tag_batch(self, texts, mentions = False):
+        if self.release is not None:
+            self.release.wait()
+        self.batches += 1
+        found, offsets = [], []
+        for text in texts:
+            positions = {}
+            for match in re.finditer(r'\w+', text):
+                if match.group() in self.tickers:
+                    positions.setdefault(match.group(), []).append(match.start())
+            found.append(sorted(positions) or None)
+            offsets.append([{'ticker': t, 'count': len(positions[t]), 'offsets': positions[t]} for t in sorted(positions)] or None)
+        return pa.array(found, type = pa.list_(pa.string())), pa.array(offsets, type = MENTIONS_TYPE)
+
+
+class Fake_Clock:
+    '''Every call returns a time step seconds later than the one before.'''
+    def __init__(self, start = 1620000000, step = 1):
+        self.now = start
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def record(i, epoch_time, text):
+    return {'post_id': 'p' + str(i), 'comment_id': None, 'subreddit': 'stocks', 'text_type': 'post',
+            'epoch_time': epoch_time, 'text': text, 'tickers': None, 'mentions': None}
+
+
+def test_rolling_counter_buckets_and_window():
+    counter = Rolling_Counter(resolution = 60, window = 3)
+    counter.add(0, ['AAPL'])
+    counter.add(61, ['AAPL', 'TSLA'])
+    counter.add(130, ['TSLA'])
+    assert sorted(counter.buckets) == [0, 60, 120]
+    counter.add(200, ['GME']) #bucket 180, the bucket of minute 0 leaves the window
+    assert sorted(counter.buckets) == [60, 120, 180]
+    counter.add(70, ['GME']) #late, but its bucket is still kept
+    counter.add(10, ['GME']) #too late, its bucket was dropped
+    counts = counter.counts()
+    assert counts['time'].dt.tz is not None
+    assert [(int(t.timestamp()), ticker, n) for t, ticker, n in counts.itertuples(index = False)] == \
+        [(60, 'AAPL', 1), (60, 'TSLA', 1), (60, 'GME', 1), (120, 'TSLA', 1), (180, 'GME', 1)]
+
+
+def test_checkpoints_hold_the_records_and_counts(tmp_path):
+    start = 1620000000
+    records = [record(i, start + 20 * i, ['AAPL up', 'TSLA and AAPL', 'nothing here', 'GME GME'][i % 4]) for i in range(40)]
+    stream = Mention_Stream(iter(records), Fake_Ticker_Extractor(), str(tmp_path), batch_size = 5, checkpoint_every = 10,
+                            clock = Fake_Clock())
+    assert stream.run() == 40
+    assert stream.checkpoints >= 2
+
+    files = sorted(f for f in os.listdir(tmp_path) if f.startswith('stream_'))
+    stored = pa.concat_tables([pq.read_table(os.path.join(tmp_path, f)) for f in files]).to_pandas()
+    assert len(files) > 1 and sorted(stored['post_id']) == sorted(r['post_id'] for r in records)
+    tagged = stored.set_index('post_id')
+    assert list(tagged.loc['p1', 'tickers']) == ['AAPL', 'TSLA']
+    assert tagged.loc['p2', 'tickers'] is None
+    assert tagged.loc['p3', 'mentions'][0]['count'] == 2
+
+    minutes = pd.read_parquet(os.path.join(tmp_path, 'minute_counts.parquet'))
+    assert minutes['mentions'].sum() == 40                     #every document counts once for each of its tickers
+    assert minutes.groupby('ticker')['mentions'].sum().to_dict() == {'AAPL': 20, 'GME': 10, 'TSLA': 10}
+    hours = pd.read_parquet(os.path.join(tmp_path, 'hour_counts.parquet'))
+    assert hours.groupby('ticker')['mentions'].sum().to_dict() == {'AAPL': 20, 'GME': 10, 'TSLA': 10}
+    assert not [f for f in os.listdir(tmp_path) if f.endswith('.tmp')]
+
+
+def test_small_queue_blocks_the_reader(tmp_path):
+    read = []
+    def source():
+        for i in range(50):
+            read.append(i)
+            yield record(i, 1620000000 + i, 'AAPL')
+
+    release = threading.Event()
+    stream = Mention_Stream(source(), Fake_Ticker_Extractor(release = release), str(tmp_path), queue_size = 3,
+                            batch_size = 2, checkpoint_every = 3600)
+    runner = threading.Thread(target = stream.run)
+    runner.start()
+    time.sleep(0.5)
+    #one batch taken out and waiting to be tagged, a full queue and one record waiting to be put
+    assert 3 <= len(read) <= 2 + 3 + 1
+    assert stream.queue.qsize() <= 3
+    release.set()
+    runner.join(timeout = 10)
+    assert not runner.is_alive()
+    assert stream.records == 50 and len(read) == 50
+    assert stream.peak_queue <= 3
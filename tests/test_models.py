@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+from tools.Models import Data_Analyzer, Series_Cache
+import tools.Significance as significance
+
+
+def analyzer(mentions, volume):
+    '''A Data_Analyzer of the given data, without reading the data folder.'''
+    D = Data_Analyzer.__new__(Data_Analyzer)
+    D.data_version = 0
+    D.cache = Series_Cache()
+    D.market_timezone = None
+    D.count_by = 'documents'
+    D.model_data = mentions.sort_index(ascending = False)   #newest day first, like the real data
+    D.yahoo_data = volume.sort_index(ascending = False)
+    D.acro_new = mentions.columns.tolist()
+    return D
+
+
+def following_volume(lag = 1):
+    '''Mentions of random size and a volume that follows the mentions of lag days before.'''
+    rng = np.random.default_rng(0)
+    days = pd.bdate_range('2021-03-18', periods = 80)
+    mentions = pd.DataFrame({'AAPL': rng.integers(100, 10000, len(days)).astype(float)}, index = days)
+    volume = pd.DataFrame({'AAPL': 1000 * mentions['AAPL'].shift(lag)}, index = days).iloc[lag:]
+    return analyzer(mentions.iloc[lag:], volume)
+
+
+def test_positive_lags_compare_mentions_with_later_volume():
+    D = following_volume(lag = 1)
+    sweep = D.get_lag_sweep(range(-3, 4))
+    assert sweep.loc['AAPL', ('Pearson', 1)] > 0.999
+    assert abs(sweep.loc['AAPL', ('Pearson', -1)]) < 0.5
+    assert sweep.loc['AAPL', ('Incidence', 1)] == D.get_incidence_offset('AAPL', 1, 0)
+    best = D.get_best_lags('Pearson', range(1, 4))
+    assert best.loc['AAPL', 'Lag'] == 1
+
+
+def test_lag_sweep_and_walk_forward_agree_on_the_direction():
+    D = following_volume(lag = 2)
+    best = D.get_best_lags('Pearson', range(1, 4))
+    assert best.loc['AAPL', 'Lag'] == 2 and best.loc['AAPL', 'Pearson'] > 0.999
+    scores = D.get_walk_forward_scores(D.get_walk_forward(window = 20, horizon = 2))
+    assert scores.loc['AAPL', 'R2'] > 0.9
+
+
+def random_data(seed = 0):
+    '''Mentions with zeros and volumes with gaps for a few stocks, the volume missing some of the reddit days.'''
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range('2021-03-18', periods = 60)
+    acro = ['AAPL', 'AMD', 'GME', 'TSLA']
+    mentions = pd.DataFrame(rng.integers(0, 5, (len(days), len(acro))).astype(float), index = days, columns = acro)
+    volume = pd.DataFrame(rng.integers(1, 10**6, (len(days), len(acro))).astype(float), index = days, columns = acro)
+    volume.iloc[rng.integers(0, len(days), 10), rng.integers(0, len(acro), 10)] = np.nan
+    return mentions, volume.drop(days[[3, 17, 40]])
+
+
+def looped_incidence(D, stock_name, offset_mentions, offset_volume):
+    '''The per-stock incidence of the row loop get_incidence_matrix replaced.'''
+    mtn = D.model_data[stock_name].pct_change().replace(np.inf, np.nan).interpolate()
+    vol = D.yahoo_data[stock_name].pct_change().replace(np.inf, np.nan).interpolate()
+    directed_data = pd.concat([mtn, vol], axis = 1, join = 'inner', keys = ['Mentions', 'Volume']).diff()
+    directed_data = np.sign(directed_data).fillna(0)
+    n = directed_data.shape[0]
+    incidence = []
+    for r in range(n):
+        if 0 <= r + offset_mentions < n and 0 <= r + offset_volume < n:
+            incidence.append(directed_data['Mentions'].iloc[r + offset_mentions] == directed_data['Volume'].iloc[r + offset_volume])
+    return round(sum(incidence) / len(incidence), 4)
+
+
+def test_incidence_matrix_matches_the_per_stock_loop():
+    D = analyzer(*random_data())
+    offsets = [(0, 0), (0, 1), (0, 2), (1, 3), (3, 0), (-2, 1)]
+    incidence_df = D.get_incidence_matrix(offsets, ['TSLA', 'AAPL', 'MISSING', 'GME'])
+    assert list(incidence_df.index) == ['TSLA', 'AAPL', 'MISSING', 'GME']
+    assert incidence_df.loc['MISSING'].isna().all()
+    for stock_name in ['TSLA', 'AAPL', 'GME']:
+        for offset in offsets:
+            assert incidence_df.loc[stock_name, offset] == looped_incidence(D, stock_name, *offset), (stock_name, offset)
+
+
+def test_assigning_data_invalidates_the_cached_series():
+    mentions, volume = random_data()
+    D = analyzer(mentions, volume)
+    first = D.get_incidence_matrix([(0, 1)])
+    D.get_incidence_matrix([(0, 1)])
+    assert D.get_cache_info()['hits'] == len(mentions.columns) #the directions of every stock, on the second call
+
+    D.model_data = D.model_data * np.arange(1, len(mentions) + 1)[::-1, None]
+    changed = D.get_incidence_matrix([(0, 1)])
+    fresh = analyzer(D.model_data, volume).get_incidence_matrix([(0, 1)])
+    pd.testing.assert_frame_equal(changed, fresh)
+    assert not changed.equals(first)
+
+    other_mentions, other_volume = random_data(seed = 1)
+    D.yahoo_data = other_volume.sort_index(ascending = False)
+    pd.testing.assert_frame_equal(D.get_change_matrices()[1], analyzer(D.model_data, other_volume).get_change_matrices()[1])
+
+
+def test_outcome_runs_the_shift_test_only_and_names_the_direction(monkeypatch, capsys):
+    D = following_volume(lag = 1)
+    monkeypatch.setattr(significance, 'block_bootstrap', None) #fails if the verdict asks for the intervals
+    D.get_outcome(1, 0)
+    printed = capsys.readouterr().out
+    assert 'Reddit did a great job this time.' in printed
+    assert 'predict volume of traded stocks 1 day ahead' in printed
+    D.get_outcome(0, 2)
+    assert 'stock movement 2 days ago' in capsys.readouterr().out
+    assert D.get_significance([(0, 1)], n_boot = 0)['CI low'].isna().all().all()
+
+
+@pytest.mark.parametrize('arguments', [{'window': 0}, {'window': -3}, {'window': 5, 'min_periods': 10},
+                                       {'window': 20, 'min_periods': 0}, {'window': 20, 'horizon': -1}])
+def test_walk_forward_rejects_impossible_windows(arguments):
+    with pytest.raises(ValueError):
+        following_volume().get_walk_forward(**arguments)
@@ -0,0 +1,70 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tools.Parquet_Stream import Parquet_Stream_Writer, append_table, compact_parts, part_files
+
+SCHEMA = pa.schema([('post_id', pa.string()), ('epoch_time', pa.int64())])
+
+
+def records(start, stop):
+    return [{'post_id': 'p' + str(i), 'epoch_time': i} for i in range(start, stop)]
+
+
+def killed_writer(path, rows, row_group_size = 2):
+    '''Write the rows without closing, like a run killed with kill -9 halfway through a row group.'''
+    writer = Parquet_Stream_Writer(path, SCHEMA, row_group_size = row_group_size)
+    for record in rows:
+        writer.write(record)
+    with open(os.path.join(path + '.parts', '.part_999999.parquet.tmp'), 'wb') as tmp: #a part cut off while written
+        tmp.write(b'PAR1 truncated')
+    return writer
+
+
+def test_parts_of_a_killed_writer_stay_readable(tmp_path):
+    path = str(tmp_path / '01_04_21.parquet')
+    killed_writer(path, records(0, 5))
+    assert not os.path.exists(path)
+    assert len(part_files(path)) == 2 #the fifth record was still buffered
+    assert pq.read_table(path + '.parts').column('post_id').to_pylist() == ['p0', 'p1', 'p2', 'p3']
+
+
+def test_compact_parts_recovers_a_killed_run(tmp_path):
+    path = str(tmp_path / '01_04_21.parquet')
+    killed_writer(path, records(0, 5))
+    assert compact_parts(path) == 4
+    assert not os.path.exists(path + '.parts')
+    table = pq.read_table(path)
+    assert table.schema.equals(SCHEMA)
+    assert table.column('epoch_time').to_pylist() == [0, 1, 2, 3]
+    assert pq.ParquetFile(path).num_row_groups == 2
+    assert compact_parts(str(tmp_path / '02_04_21.parquet')) == 0 #nothing to recover
+
+
+def test_a_new_writer_continues_after_a_killed_one(tmp_path):
+    path = str(tmp_path / '01_04_21.parquet')
+    killed_writer(path, records(0, 5))
+    with Parquet_Stream_Writer(path, SCHEMA, row_group_size = 2) as writer:
+        for record in records(5, 8):
+            writer.write(record)
+    assert writer.written == 3
+    assert not os.path.exists(path + '.parts')
+    assert pq.read_table(path).column('post_id').to_pylist() == ['p0', 'p1', 'p2', 'p3', 'p5', 'p6', 'p7']
+
+
+def test_append_keeps_the_rows_of_an_earlier_run(tmp_path):
+    path = str(tmp_path / '01_04_21.parquet')
+    append_table(path, pa.Table.from_pylist(records(0, 2), schema = SCHEMA))
+    with Parquet_Stream_Writer(path, SCHEMA, row_group_size = 2, append = True) as writer:
+        for record in records(2, 5):
+            writer.write(record)
+    assert pq.read_table(path).column('epoch_time').to_pylist() == [0, 1, 2, 3, 4]
+
+    killed_writer(path, records(5, 8))
+    assert compact_parts(path, append = True) == 7
+    assert append_table(path, pa.Table.from_pylist(records(8, 9), schema = SCHEMA)) == 8
+    assert pq.read_table(path).column('epoch_time').to_pylist() == [0, 1, 2, 3, 4, 5, 6, 8]
+    assert compact_parts(path, SCHEMA, append = True) == 8 #no parts, the file is kept as it is
+
+    with Parquet_Stream_Writer(path, SCHEMA) as writer: #without append the file is replaced
+        writer.write(records(9, 10)[0])
+    assert pq.read_table(path).column('epoch_time').to_pylist() == [9]
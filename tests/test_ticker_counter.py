@@ -0,0 +1,110 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tools import Ticker_Counter
+from tools.Ticker_Counter import SCHEMA, Ticker_Matrix, bucket_days, encode_ids, exchange_holidays
+
+
+def epochs(*times):
+    return [pd.Timestamp(time, tz = 'US/Eastern').timestamp() for time in times]
+
+
+def test_exchange_holidays_2021():
+    holidays = [str(day) for day in exchange_holidays('2021-01-01', '2021-12-31')]
+    assert '2021-04-02' in holidays #good friday
+    assert '2021-07-05' in holidays #independence day, observed on monday
+    assert '2021-10-11' not in holidays #columbus day, the exchange is open
+
+
+def test_mentions_on_holidays_roll_to_next_trading_day():
+    days = bucket_days(epochs('2021-04-01 17:00', '2021-04-02 12:00', '2021-07-05 10:00', '2021-07-06 15:00'),
+                       'US/Eastern', '16:00')
+    assert [str(day.date()) for day in days] == ['2021-04-05', '2021-04-05', '2021-07-06', '2021-07-06']
+
+
+def test_explicit_holidays_replace_the_calendar():
+    days = bucket_days(epochs('2021-04-02 12:00', '2021-04-06 12:00'), 'US/Eastern', '16:00', holidays = ['2021-04-06'])
+    assert [str(day.date()) for day in days] == ['2021-04-02', '2021-04-07']
+
+
+def test_utc_days_without_market_timezone():
+    days = bucket_days([pd.Timestamp('2021-04-02 12:00', tz = 'UTC').timestamp()])
+    assert [str(day.date()) for day in days] == ['2021-04-02']
+
+
+def write_day(folder, name, rows):
+    '''Write a daily file of (post_id, comment_id, text_type, time, tickers) rows.'''
+    post_ids, comment_ids, text_types, times, tickers = zip(*rows)
+    table = pa.table({'post_id': list(post_ids), 'comment_id': list(comment_ids),
+                      'subreddit': ['stocks'] * len(rows), 'text_type': list(text_types),
+                      'epoch_time': epochs(*times), 'tickers': list(tickers)}, schema = SCHEMA)
+    pq.write_table(table, os.path.join(folder, name))
+
+
+def test_reddit_ids_round_trip_through_int64():
+    ids = ['0', 'z', 'mz8k2q', 'gu5ogd1', 'GU5OGD1', 'zzzzzzzzzzzz', '', None]
+    numbers = encode_ids(ids)
+    assert numbers.dtype == np.int64
+    assert numbers.tolist() == [0, 35, int('mz8k2q', 36), int('gu5ogd1', 36), int('gu5ogd1', 36), 36**12 - 1, -1, -1]
+    assert [np.base_repr(number, 36).lower() for number in numbers[:6]] == ['0', 'z', 'mz8k2q', 'gu5ogd1', 'gu5ogd1', 'z' * 12]
+    assert encode_ids([]).tolist() == []
+
+
+def test_posts_and_comments_scraped_twice_count_once(tmp_path):
+    write_day(tmp_path, '01_04_21.parquet', [('p1', None, 'post', '2021-04-01 10:00', ['TSLA']),
+                                             ('p1', 'c1', 'comment', '2021-04-01 11:00', ['TSLA', 'AAPL'])])
+    write_day(tmp_path, '02_04_21.parquet', [('p1', None, 'post', '2021-04-01 10:00', ['TSLA']),
+                                             ('p1', 'c1', 'comment', '2021-04-01 11:00', ['TSLA', 'AAPL']),
+                                             ('p1', 'c2', 'comment', '2021-04-02 11:00', ['TSLA']),
+                                             ('p2', None, 'post', '2021-04-02 12:00', ['AAPL']),
+                                             ('p2', None, 'post', '2021-04-02 12:00', ['AAPL'])])
+    matrix = Ticker_Matrix(str(tmp_path), use_cache = False, min_mentions = 1)
+    assert matrix.ticker_matrix.loc['2021-04-01'].to_dict() == {'AAPL': 1, 'TSLA': 2}
+    assert matrix.ticker_matrix.loc['2021-04-02'].to_dict() == {'AAPL': 1, 'TSLA': 1}
+    assert matrix.duplicates.to_dict('list') == {'posts': [0, 2], 'comments': [0, 1]}
+
+
+def parsed_files(monkeypatch, folder):
+    '''Build a Ticker_Matrix of the folder and return it with the daily files it parsed rather than read from the cache.'''
+    parsed = []
+    read_files = Ticker_Matrix.read_files
+    def spy(self, files):
+        parsed.extend(files)
+        return read_files(self, files)
+    monkeypatch.setattr(Ticker_Matrix, 'read_files', spy)
+    return Ticker_Matrix(str(folder), min_mentions = 1), parsed
+
+
+def test_unchanged_files_come_from_the_cache(tmp_path, monkeypatch):
+    write_day(tmp_path, '01_04_21.parquet', [('a1', None, 'post', '2021-04-01 10:00', ['TSLA'])])
+    write_day(tmp_path, '02_04_21.parquet', [('a2', None, 'post', '2021-04-02 10:00', ['AAPL'])])
+    first, parsed = parsed_files(monkeypatch, tmp_path)
+    assert parsed == ['01_04_21.parquet', '02_04_21.parquet']
+
+    again, parsed = parsed_files(monkeypatch, tmp_path)
+    assert parsed == []
+    pd.testing.assert_frame_equal(again.ticker_matrix, first.ticker_matrix)
+
+    #a touched file is parsed again, the files before it still come from the cache
+    file_stat = os.stat(tmp_path / '02_04_21.parquet')
+    os.utime(tmp_path / '02_04_21.parquet', ns = (file_stat.st_atime_ns, file_stat.st_mtime_ns + 10**9))
+    again, parsed = parsed_files(monkeypatch, tmp_path)
+    assert parsed == ['02_04_21.parquet']
+    pd.testing.assert_frame_equal(again.ticker_matrix, first.ticker_matrix)
+
+    write_day(tmp_path, '03_04_21.parquet', [('a3', None, 'post', '2021-04-03 10:00', ['TSLA'])])
+    again, parsed = parsed_files(monkeypatch, tmp_path)
+    assert parsed == ['03_04_21.parquet']
+    assert again.ticker_matrix['TSLA'].sum() == 2
+
+
+def test_cache_of_an_older_version_is_rebuilt(tmp_path, monkeypatch):
+    write_day(tmp_path, '01_04_21.parquet', [('a1', None, 'post', '2021-04-01 10:00', ['TSLA'])])
+    parsed_files(monkeypatch, tmp_path)
+    monkeypatch.setattr(Ticker_Counter, 'CACHE_VERSION', Ticker_Counter.CACHE_VERSION + 1)
+    matrix, parsed = parsed_files(monkeypatch, tmp_path)
+    assert parsed == ['01_04_21.parquet']
+    assert matrix.ticker_matrix['TSLA'].sum() == 1
+    assert sorted(os.listdir(tmp_path / '.ticker_cache')) == ['counts_01_04_21.parquet', 'manifest.json', 'rows_01_04_21.parquet']
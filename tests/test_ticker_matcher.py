@@ -0,0 +1,105 @@
+import json
+import random
+import re
+import pandas as pd
+import pyarrow as pa
+import pytest
+from tools.Extractor import Ticker_Extractor, Ticker_Matcher
+from tools.Stock_Dictionary import build_dict, load_rules
+
+CONSTITUENTS = [['AAPL', 'Apple Inc.'], ['AMZN', 'Amazon.com Inc.'], ['BRK.B', 'Berkshire Hathaway'],
+                ['DISCA', 'Discovery, Inc. (Series A)'], ['DOW', 'Dow Inc.'], ['GOOG', 'Alphabet Inc. (Class C)'],
+                ['GOOGL', 'Alphabet Inc. (Class A)'], ['NDAQ', 'Nasdaq, Inc.'], ['SPGI', 'S&P Global Inc.'],
+                ['T', 'AT&T Inc.'], ['TGT', 'Target Corporation'], ['TSLA', 'Tesla, Inc.']]
+
+TEXTS = ['S&P is up', 'the S&P500 is up', 'S&P500', 's&p 500', 'S&Pfoo', 'sp500',
+         'bought $TSLA and $AAPL', '$T', 'TSLA$', '$$BRK.B',
+         'google it', 'see google.com', 'Google, again', 'GOOGLE ', 'googl', 'GOOGL to the moon',
+         'BRK.B', 'BRK B', 'brkxb', 'berkshire hathaway', 'Berkshire',
+         'AT&T', 'at&t inc', 'T-mobile', 'AT&T.', 'what about T?',
+         'Discovery, (Series A)', 'Discovery,  (Series A)', 'Discovery, Series A', 'Alphabet  (Class A)', 'alphabet',
+         'Amazon', 'amazon.com', 'Target', 'TGT price target', 'DJIA and DJI', 'NASDAQ100', 'nasdaq',
+         'apple pie', 'Tesla', 'TSLAQ', 'xTSLA', '', 'no tickers at all']
+
+
+def dictionary():
+    rules = dict(load_rules(), min_ticker_length = 1) #keeps T, so AT&T is in the dictionary
+    return build_dict(pd.DataFrame(CONSTITUENTS, columns = ['Symbol', 'Security']), rules)
+
+
+def searched(stockDict, text):
+    '''The tickers found by the per-key re.search loop the matcher replaced.'''
+    return {key for key, pattern in stockDict.items() if re.search(pattern, text, re.IGNORECASE) is not None}
+
+
+def found(stockDict, text):
+    '''The mentions of the per-key pattern as re.finditer finds them, [(ticker, [offsets])] in dictionary order.'''
+    mentions = []
+    for key, pattern in stockDict.items():
+        offsets = [match.start() for match in re.finditer(pattern, text, re.IGNORECASE)]
+        if offsets:
+            mentions.append((key, offsets))
+    return mentions
+
+
+@pytest.mark.parametrize('saved', [False, True])
+def test_matcher_finds_the_same_tickers_as_re_search(saved):
+    stockDict = dictionary()
+    matcher = Ticker_Matcher(stockDict)
+    if saved:
+        matcher = Ticker_Matcher.fromSpec(json.loads(json.dumps(matcher.spec())))
+    for text in TEXTS:
+        assert set(matcher.findTickers(text)) == searched(stockDict, text), text
+
+
+def test_matcher_on_random_texts():
+    stockDict = dictionary()
+    matcher = Ticker_Matcher(stockDict)
+    words = [word for text in TEXTS for word in text.split()] + ['$', '.', ',', '&', '(', ')', '500', 'P', 'S']
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = ''.join(rng.choice(words) + rng.choice(['', ' ', '  ', '.', '-', '\n']) for _ in range(rng.randint(1, 8)))
+        assert set(matcher.findTickers(text)) == searched(stockDict, text), text
+        assert matcher.findMentions(text) == found(stockDict, text), text
+
+
+def test_known_cases():
+    matcher = Ticker_Matcher(dictionary())
+    assert matcher.findTickers('the S&P500 is up') == ['SPGI']
+    assert matcher.findTickers('bought $TSLA') == ['TSLA']          #found by the plain ticker
+    assert Ticker_Matcher({'TSLA': '(\\b$TSLA\\b)'}).findTickers('bought $TSLA') == [] #"$" anchors the end, never matches
+    assert matcher.findTickers('see google.com') == []
+    assert matcher.findTickers('google it') == ['GOOGL']
+    assert matcher.findTickers('BRK.B and AT&T') == ['BRK.B', 'T']
+
+
+def test_mentions_match_re_finditer():
+    stockDict = dictionary()
+    matcher = Ticker_Matcher(stockDict)
+    texts = TEXTS + [' '.join(TEXTS), 'TSLA TSLA tsla $TSLA', 'S&P and S&P500 and s&p 500', 'AT&T or at&t, not T']
+    for text in texts:
+        assert matcher.findMentions(text) == found(stockDict, text), text
+
+
+def test_tag_batch_matches_ticker_counter():
+    extractor = Ticker_Extractor(dictionary())
+    texts = TEXTS + [None, float('nan'), '', 'S&P is up', 'S&P is up', 'bought $TSLA and $AAPL']
+    expected = [extractor.tickerCounter(text) if isinstance(text, str) else None for text in texts]
+    expectedMentions = [extractor.mentionCounter(text) if isinstance(text, str) else None for text in texts]
+    for column in [texts, pd.Series(texts, dtype = object), pa.array(texts[:-7] + [None]),
+                   pa.chunked_array([texts[:10], texts[10:-7]])]:
+        length = len(column)
+        assert extractor.tag_batch(column, chunk_size = 7).to_pylist() == expected[:length]
+        tickers, mentions = extractor.tag_batch(column, chunk_size = 7, mentions = True)
+        assert tickers.to_pylist() == expected[:length]
+        assert mentions.to_pylist() == expectedMentions[:length]
+
+
+def test_tag_batch_matches_each_distinct_text_once_per_chunk():
+    extractor = Ticker_Extractor(dictionary())
+    matched = []
+    findTickers = extractor.matcher.findTickers
+    extractor.matcher.findTickers = lambda text: matched.append(text) or findTickers(text)
+    tickers = extractor.tag_batch(['[deleted]', 'TSLA', '[deleted]', 'TSLA', None, '[deleted]', 'TSLA'], chunk_size = 4)
+    assert tickers.to_pylist() == [None, ['TSLA'], None, ['TSLA'], None, None, ['TSLA']]
+    assert matched == ['[deleted]', 'TSLA', '[deleted]', 'TSLA'] #once in each of the two chunks
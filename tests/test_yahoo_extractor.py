@@ -0,0 +1,113 @@
+import os
+import pandas as pd
+import pytest
+from tools.Yahoo_Extractor import Yahoo_Extractor, Adaptive_Rate_Limiter
+
+
+class Fake_Response:
+    def __init__(self, status_code, text = '', headers = None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class Fake_Session:
+    '''Stands in for requests.Session: answers with the given status codes, then with the volumes of the asked days.
+    Tickers in pages are answered with their page instead, with a 200 status.'''
+    def __init__(self, statuses = (), pages = None):
+        self.statuses = list(statuses)
+        self.pages = pages or {}
+        self.requests = []
+
+    def get(self, url, params = None, timeout = None):
+        self.requests.append(dict(params))
+        if self.statuses:
+            status = self.statuses.pop(0)
+            if status != 200:
+                return Fake_Response(status, headers = {'Retry-After': '0'} if status == 429 else None)
+        if url.rsplit('/', 1)[1] in self.pages:
+            return Fake_Response(200, self.pages[url.rsplit('/', 1)[1]])
+        days = pd.bdate_range(pd.Timestamp(params['period1'], unit = 's'), pd.Timestamp(params['period2'] - 1, unit = 's'))
+        rows = pd.DataFrame({'Date': days.strftime('%Y-%m-%d'), 'Volume': days.day * 1000})
+        return Fake_Response(200, rows.to_csv(index = False))
+
+
+def extractor(start = '2021-03-18', end = '2021-03-31', statuses = (), cache_dir = None, retries = 3):
+    limiter = Adaptive_Rate_Limiter(min_interval = 0.001, max_interval = 0.05)
+    Y = Yahoo_Extractor(start, end, base_url = 'http://yahoo.test/', cache_dir = cache_dir, rate_limiter = limiter, retries = retries)
+    Y.session = Fake_Session(statuses)
+    return Y
+
+
+def stored(start, end, acro):
+    days = pd.bdate_range(start, end)
+    return pd.DataFrame({a: 1000 for a in acro}, index = days)
+
+
+def test_missing_ranges_without_stored_data():
+    Y = extractor()
+    assert Y.missing_ranges(pd.DataFrame(), ['AAPL', 'MSFT']) == {'AAPL': ('2021-03-18', '2021-03-31'),
+                                                                   'MSFT': ('2021-03-18', '2021-03-31')}
+
+
+def test_missing_ranges_partial_overlap():
+    data = stored('2021-03-22', '2021-03-25', ['AAPL', 'MSFT'])
+    data.loc['2021-03-24':, 'MSFT'] = None
+    ranges = extractor().missing_ranges(data, ['AAPL', 'MSFT', 'TSLA'])
+    assert ranges == {'AAPL': ('2021-03-18', '2021-03-31'),  #days missing before and after the stored ones
+                      'MSFT': ('2021-03-18', '2021-03-31'),
+                      'TSLA': ('2021-03-18', '2021-03-31')}
+    ranges = extractor(start = '2021-03-22').missing_ranges(data, ['AAPL', 'MSFT'])
+    assert ranges == {'AAPL': ('2021-03-26', '2021-03-31'), 'MSFT': ('2021-03-24', '2021-03-31')}
+
+
+def test_missing_ranges_fully_stored():
+    data = stored('2021-03-18', '2021-03-31', ['AAPL', 'MSFT'])
+    assert extractor().missing_ranges(data, ['AAPL', 'MSFT']) == {}
+    assert extractor(end = '2021-04-03').missing_ranges(stored('2021-03-18', '2021-04-02', ['AAPL']), ['AAPL']) == {}
+
+
+def test_rate_limiter_backs_off_and_recovers():
+    Y = extractor(statuses = [429, 503, 429])
+    text = Y.download('AAPL', {'period1': 1616025600, 'period2': 1616112000})
+    assert 'Volume' in text
+    assert len(Y.session.requests) == 4
+    assert Y.rate_limiter.interval == pytest.approx(0.008 * 0.9)    #doubled three times, shortened once
+    for _ in range(30):
+        Y.download('AAPL', {'period1': 1616025600, 'period2': 1616112000})
+    assert Y.rate_limiter.interval == Y.rate_limiter.min_interval
+
+
+def test_rate_limiter_caps_the_interval_and_gives_up():
+    Y = extractor(statuses = [503] * 10, retries = 7)
+    assert Y.download('AAPL', {'period1': 1616025600, 'period2': 1616112000}) is None
+    assert len(Y.session.requests) == 8
+    assert Y.rate_limiter.interval == Y.rate_limiter.max_interval     #0.001 doubled 8 times is capped at 0.05
+    Y = extractor(statuses = [404])
+    assert Y.download('GONE', {'period1': 1616025600, 'period2': 1616112000}) is None
+    assert len(Y.session.requests) == 1                              #not found is not retried
+
+
+def test_cache_merges_overlapping_ranges(tmp_path):
+    Y = extractor(cache_dir = str(tmp_path))
+    first = Y.get_data('AAPL', '2021-03-18', '2021-03-24')
+    assert list(first.index) == ['Mar 24, 2021', 'Mar 23, 2021', 'Mar 22, 2021', 'Mar 19, 2021', 'Mar 18, 2021']
+    both = Y.get_data('AAPL', '2021-03-15', '2021-03-31')
+    assert len(Y.session.requests) == 3                              #only the days around the cached ones
+    assert list(both.loc[first.index, 'AAPL']) == list(first['AAPL'])
+    assert len(both) == len(pd.bdate_range('2021-03-15', '2021-03-31'))
+    assert os.listdir(tmp_path) == ['AAPL_1d_1615766400_1617235200.csv'] #the smaller range was pruned
+    inside = Y.get_data('AAPL', '2021-03-20', '2021-03-26')
+    assert len(Y.session.requests) == 3 and len(inside) == 5
+
+
+def test_pages_without_volumes_count_as_failed_downloads(tmp_path):
+    Y = extractor(cache_dir = str(tmp_path / 'cache'))
+    Y.session.pages = {'CONSENT': '<html><body>Before you continue to Yahoo</body></html>',
+                       'ERROR': '{"finance":{"error":{"code":"Not Found"}}}', 'EMPTY': ''}
+    for acro in Y.session.pages:
+        assert Y.get_data(acro) is None
+    data = Y.update_data(str(tmp_path / 'yahoo_data.csv'), ['AAPL', 'CONSENT', 'ERROR', 'EMPTY'])
+    assert list(data.columns) == ['AAPL']
+    assert len(data) == len(pd.bdate_range('2021-03-18', '2021-03-31'))
+    assert os.listdir(tmp_path / 'cache') == ['AAPL_1d_1616025600_1617235200.csv']
@@ -0,0 +1,231 @@
+import os
+import time
+import queue
+import threading
+from collections import Counter
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tools.Extractor import ARROW_SCHEMA
+
+_END = object() #put in the queue by the reader when the source is exhausted
+
+
+class Rolling_Counter:
+    '''Counts ticker mentions in fixed time buckets (e.g. minutes) and keeps only the latest window of buckets.
+
+    :usage:
+        minutes = Rolling_Counter(resolution = 60, window = 120)
+        minutes.add(epoch_time, ['AAPL', 'TSLA'])
+        minutes.counts()
+
+    :note:
+    - Buckets follow the time the text was created (epoch_time), not the time it arrived, so replayed and
+        late records are counted where they belong. Buckets older than the window behind the newest one are dropped.
+    '''
+    def __init__(self, resolution, window):
+        '''The constructor for the Rolling_Counter class.
+
+        :args:
+        - resolution (int): Length of one bucket in seconds.
+        - window (int): Number of buckets kept.
+        '''
+        self.resolution = resolution
+        self.window = window
+        self.buckets = {}
+        self.newest = None
+
+    def add(self, epoch_time, tickers):
+        '''Count the tickers of one text created at epoch_time.'''
+        bucket = int(epoch_time) // self.resolution * self.resolution
+        if self.newest is not None and bucket <= self.newest - self.window * self.resolution:
+            return None #too late, its bucket was already dropped
+        self.buckets.setdefault(bucket, Counter()).update(tickers)
+        if self.newest is None or bucket > self.newest:
+            self.newest = bucket
+            oldest = bucket - self.window * self.resolution
+            for old in [b for b in self.buckets if b <= oldest]:
+                del self.buckets[old]
+
+        return None
+
+    def counts(self):
+        '''Return the kept buckets as a long dataframe with columns time (UTC), ticker and mentions.'''
+        rows = [(bucket, ticker, mentions) for bucket, counter in sorted(self.buckets.items())
+                for ticker, mentions in counter.items()]
+        df = pd.DataFrame(rows, columns = ['time', 'ticker', 'mentions'])
+        df['time'] = pd.to_datetime(df['time'], unit = 's', utc = True)
+        df['mentions'] = df['mentions'].astype('int64')
+
+        return df
+
+
+class Mention_Stream:
+    '''Tags a continuous stream of posts and comments and keeps rolling per-minute and per-hour mention counts.
+
+    :usage:
+        stream = Mention_Stream(extr.streamRecords(subreddits), Ticker_Extractor(get_dict()), './data/stream_parquet_data/')
+        stream.run()
+
+    :note:
+    - The source is any iterable of records (dicts with the columns of ARROW_SCHEMA), e.g. Reddit_Extractor.streamRecords,
+        replay_records for stored files, or a hand-made list in a test.
+    - The source is read by its own thread into a bounded queue. When tagging falls behind, the queue fills up and
+        the reader blocks, which also stops the reddit polling instead of piling up records in memory.
+    - Every checkpoint_every seconds the new records are written to their own parquet file and the rolling counts
+        replace minute_counts.parquet and hour_counts.parquet in the same folder.
+    '''
+    def __init__(self, source, ticker_extractor, path, queue_size = 10000, batch_size = 500, checkpoint_every = 300,
+                 minute_window = 120, hour_window = 48, clock = time.time):
+        '''The constructor for the Mention_Stream class.
+
+        :args:
+        - source (iterable): Records to process.
+        - ticker_extractor (Ticker_Extractor): Tags the texts.
+        - path (str): Folder of the checkpoint files.
+        - queue_size (int): Maximum number of records waiting to be tagged.
+        - batch_size (int): Maximum number of records tagged at once.
+        - checkpoint_every (float): Seconds between checkpoints.
+        - minute_window (int): Number of minutes kept by the per-minute counter.
+        - hour_window (int): Number of hours kept by the per-hour counter.
+        - clock (function): Returns the current time in seconds, replaceable in tests.
+        '''
+        self.source = source
+        self.ticker_extractor = ticker_extractor
+        self.path = path
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self.clock = clock
+        self.queue = queue.Queue(maxsize = queue_size)
+        self.stopped = threading.Event()
+        self.minutes = Rolling_Counter(60, minute_window)
+        self.hours = Rolling_Counter(3600, hour_window)
+        self.columns = {name: [] for name in ARROW_SCHEMA.names}
+        self.records = 0
+        self.checkpoints = 0
+        self.peak_queue = 0
+        self.error = None
+        os.makedirs(path, exist_ok = True)
+
+    def read_source(self):
+        '''Move the records of the source to the queue, runs in the reader thread.'''
+        try:
+            for record in self.source:
+                while not self.stopped.is_set():
+                    try:
+                        self.queue.put(record, timeout = 1) #blocks while the queue is full
+                        break
+                    except queue.Full:
+                        continue
+                if self.stopped.is_set():
+                    break
+        except BaseException as error: #handed over to the processing thread
+            self.error = error
+        finally:
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put(_END, timeout = 1)
+                    break
+                except queue.Full:
+                    continue
+
+    def next_batch(self, timeout):
+        '''Return up to batch_size queued records, waiting at most timeout seconds for the first one.'''
+        batch = []
+        try:
+            record = self.queue.get(timeout = timeout)
+            while True:
+                if record is _END:
+                    return batch, True
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                record = self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        return batch, False
+
+    def process(self, batch):
+        '''Tag a batch of records, count its mentions and buffer it for the next checkpoint.'''
+        texts = [record.get('text') for record in batch]
+        tickers, mentions = self.ticker_extractor.tag_batch(texts, mentions = True)
+        for record, found, mentioned in zip(batch, tickers.to_pylist(), mentions.to_pylist()):
+            if found:
+                self.minutes.add(record['epoch_time'], found)
+                self.hours.add(record['epoch_time'], found)
+            tagged = dict(record, tickers = found, mentions = mentioned)
+            for name in self.columns:
+                self.columns[name].append(tagged.get(name))
+        self.records += len(batch)
+
+        return None
+
+    def write_table(self, df, name):
+        '''Replace a parquet file of the checkpoint folder atomically.'''
+        path = os.path.join(self.path, name)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index = False), path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+        return None
+
+    def checkpoint(self):
+        '''Write the records buffered since the last checkpoint and the current rolling counts.'''
+        if self.columns['post_id']:
+            name = 'stream_' + time.strftime('%Y%m%d_%H%M%S', time.gmtime(self.clock())) + '_' + str(self.checkpoints) + '.parquet'
+            pq.write_table(pa.Table.from_pydict(self.columns, schema = ARROW_SCHEMA), os.path.join(self.path, name))
+            self.columns = {name: [] for name in ARROW_SCHEMA.names}
+        self.write_table(self.minutes.counts(), 'minute_counts.parquet')
+        self.write_table(self.hours.counts(), 'hour_counts.parquet')
+        self.checkpoints += 1
+        print("Checkpoint", self.checkpoints, ":", self.records, "records, peak queue", self.peak_queue, "of", self.queue.maxsize)
+
+        return None
+
+    def stop(self):
+        '''Ask run to finish after the current batch, safe to call from another thread or a signal handler.'''
+        self.stopped.set()
+
+    def run(self):
+        '''Process the source until it is exhausted or stop is called, checkpointing on the way and at the end.
+
+        :returns:
+        - records (int): Number of processed records.
+        '''
+        reader = threading.Thread(target = self.read_source, daemon = True)
+        reader.start()
+        last_checkpoint = self.clock()
+        try:
+            while not self.stopped.is_set():
+                self.peak_queue = max(self.peak_queue, self.queue.qsize())
+                wait = max(0, last_checkpoint + self.checkpoint_every - self.clock())
+                batch, finished = self.next_batch(timeout = min(wait, 1) or 0.01)
+                if batch:
+                    self.process(batch)
+                if self.clock() - last_checkpoint >= self.checkpoint_every:
+                    self.checkpoint()
+                    last_checkpoint = self.clock()
+                if finished:
+                    break
+        finally:
+            self.stopped.set() #releases a reader blocked on a full queue
+            self.checkpoint()
+        if self.error is not None:
+            raise self.error
+
+        return self.records
+
+
+def replay_records(paths):
+    '''Yield the records of stored parquet files in the order they were created, a recorded stream for Mention_Stream.
+
+    :args:
+    - paths (list): Parquet files with the columns of ARROW_SCHEMA, tickers and mentions are not needed.
+    '''
+    schema = pa.schema([field for field in ARROW_SCHEMA if field.name not in ('tickers', 'mentions')]) #recomputed when processed
+    table = pa.concat_tables([pq.read_table(path, columns = schema.names).cast(schema) for path in paths])
+    for record in table.take(pc.sort_indices(table['epoch_time'])).to_pylist():
+        record['tickers'] = None
+        record['mentions'] = None
+        yield record
@@ -2,7 +2,109 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import copy
+from collections import OrderedDict
 import tools.Ticker_Counter as counter
+import tools.Stock_Dictionary as stock_dictionary
+import tools.Significance as significance
+
+
+def cross_sums(x, y, lags):
+    '''Return sum over r of x[r] * y[r + lag] for every lag and every column at once, using the fft.
+    
+    :args:
+    - x (np.ndarray): Days in rows and stocks in columns.
+    - y (np.ndarray): Same shape as x.
+    - lags (list): Lags to compute, negative lags shift y the other way.
+    
+    :returns:
+    - sums (np.ndarray): One row per lag and one column per stock.
+    '''
+    n = x.shape[0]
+    size = 1 << max(1, 2 * n - 1).bit_length()              #zero padding, so the correlation does not wrap around
+    spectrum = np.conj(np.fft.rfft(x, size, axis = 0)) * np.fft.rfft(y, size, axis = 0)
+    full = np.fft.irfft(spectrum, size, axis = 0)
+    rows = [lag % size if abs(lag) < n else None for lag in lags]
+    
+    return np.array([full[row] if row is not None else np.zeros(x.shape[1]) for row in rows])
+
+
+def rolling_moments(x, y, window):
+    '''Return the count, sums, sums of squares and sum of products of x and y over the window of rows ending at every row.
+    
+    :args:
+    - x (np.ndarray): Days in rows (oldest first) and stocks in columns, nan (or inf) where missing.
+    - y (np.ndarray): Same shape as x.
+    - window (int): Number of rows in a window.
+    
+    :returns:
+    - moments (tuple): n, sx, sy, sxx, syy, sxy as arrays shaped like x, counting only the rows where both x and y
+        are finite. The rows before the first full window are nan.
+    
+    :note:
+    - Every moment is a difference of two cumulative sums, so moving the window by a day costs the same
+        whatever its length, instead of summing the whole window again.
+    '''
+    both = np.isfinite(x) & np.isfinite(y)
+    x, y = np.where(both, x, 0), np.where(both, y, 0)
+    moments = []
+    for values in (both.astype(float), x, y, x * x, y * y, x * y):
+        sums = np.cumsum(np.vstack([np.zeros((1, values.shape[1])), values]), axis = 0)
+        rolled = np.full(values.shape, np.nan)
+        rolled[window - 1:] = sums[window:] - sums[:-window]
+        moments.append(rolled)
+    
+    return tuple(moments)
+
+
+class Series_Cache:
+    '''Keep the most recently used per-ticker intermediate results of Data_Analyzer.
+    
+    :usage:
+        cache = Series_Cache(max_size = 4096)
+        cache.put(('changes', 'AAPL'), version, value)
+        cache.get(('changes', 'AAPL'), version)
+        cache.info()
+    
+    :note:
+    - Every entry remembers the data version it was computed from, an entry of an older version counts as a miss
+        and is dropped. Once max_size entries are kept, the least recently used one is dropped.
+    '''
+    def __init__(self, max_size = 4096):
+        '''The constructor for the Series_Cache class.
+        
+        :args:
+        - max_size (int): Maximum number of kept entries.
+        '''
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        '''Return the value stored under key for this data version, None if there is none.'''
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, version, value):
+        '''Store a value computed from this data version under key.'''
+        self.entries[key] = (version, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+    def clear(self):
+        '''Drop all entries, the statistics are kept.'''
+        self.entries.clear()
+
+    def info(self):
+        '''Return the hits, misses, number of entries and maximum size as a dictionary.'''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'max_size': self.max_size}
 
 
 class Data_Analyzer:
@@ -11,10 +113,22 @@ class Data_Analyzer:
     :usage:
         D = Data_Analyzer()  
     '''
-    def __init__(self):
+    def __init__(self, market_timezone = None, count_by = 'documents', cache_size = 4096):
         '''
         The constructor for the Data_analyzer class.
+        
+        :args:
+        - market_timezone (str): Timezone of the market, e.g. 'US/Eastern'. If specified, reddit mentions are counted
+            by the trading day they can affect (after the close, on weekends and on exchange holidays they count towards
+            the next trading day) instead of by utc day.
+        - count_by (str): 'documents' counts the posts and comments mentioning a stock, 'mentions' counts every mention
+            in them, so a post naming a stock twenty times weighs twenty times as much.
+        - cache_size (int): Maximum number of per-ticker intermediate results kept, see get_cache_info.
         '''
+        self.data_version = 0
+        self.cache = Series_Cache(cache_size)
+        self.market_timezone = market_timezone
+        self.count_by = count_by
         self.yahoo_data = pd.read_csv('data/yahoo_data.csv', parse_dates=['Date'], infer_datetime_format="%b %d, %Y",
                          index_col = [0]).interpolate() #We use interpolation to linearly fill missing data
         
@@ -33,6 +147,49 @@ class Data_Analyzer:
         #Use the columns of stocks which appear in both data frames as a benchmark
         self.acro_new = self.model_data.columns.tolist()
 
+    #Assigning new data starts a new data version, so cached results of the old data are not used anymore
+    @property
+    def model_data(self):
+        return self._model_data
+
+    @model_data.setter
+    def model_data(self, data):
+        self._model_data = data
+        self.data_version += 1
+
+    @property
+    def yahoo_data(self):
+        return self._yahoo_data
+
+    @yahoo_data.setter
+    def yahoo_data(self, data):
+        self._yahoo_data = data
+        self.data_version += 1
+
+    def invalidate_cache(self):
+        '''Start a new data version after model_data or yahoo_data were changed in place.
+        
+        :usage:
+            self.yahoo_data.loc['Jul 07, 2021', 'AAPL'] = 0
+            self.invalidate_cache()
+        '''
+        self.data_version += 1
+        self.cache.clear()
+
+    def get_cache_info(self):
+        '''Return statistics of the cache of per-ticker intermediate results.
+        
+        :usage:
+            self.get_cache_info()
+        
+        :returns:
+        - info (dict): hits, misses, size and max_size of the cache and the current data_version.
+        '''
+        info = self.cache.info()
+        info['data_version'] = self.data_version
+        
+        return info
+
     def get_reddit_data(self):
         '''Load reddit data into Python.
         
@@ -44,7 +201,7 @@ class Data_Analyzer:
         '''
         print('Loading Reddit data. This may take a while.')
         path = "./data/daily_parquet_data/"
-        TickerMat = counter.Ticker_Matrix(path)
+        TickerMat = counter.Ticker_Matrix(path, market_timezone = self.market_timezone, count_by = self.count_by)
         TickerMat.get_info()
         print('Reddit data loaded successfully.')
         
@@ -107,9 +264,8 @@ class Data_Analyzer:
         :returns:
         - stock_data (pd.DataFrame): A data frame with percentage change between days.
         '''
-        mtn = self.model_data[stock_name].pct_change().replace(np.inf,np.nan).interpolate() #Extract mention count
-        vol = self.yahoo_data[stock_name].pct_change().replace(np.inf,np.nan).interpolate() #Extract volume traded
-        stock_data = pd.concat([mtn, vol], axis = 1, join = 'inner', keys = ['Mentions', 'Volume']) #Join these two
+        mtn, vol = self.get_change_matrices([stock_name])  #Mention count and volume traded on the common days
+        stock_data = pd.concat([mtn[stock_name], vol[stock_name]], axis = 1, keys = ['Mentions', 'Volume'])
         
         return stock_data
     
@@ -153,22 +309,369 @@ class Data_Analyzer:
             
         :returns:
         - directed_data (pd.DataFrame): A data frame indicating on which days the mentions or volume traded increased
-            or decreased. 1 indicates an increase, 0 indicates a decrease.
+            or decreased. 1 indicates an increase, -1 a decrease and 0 no change (or missing data).
         
         '''
-        directed_data = self.get_stock_data(stock_name).diff()
-
-        #Iterate over columns and rows
-        for x in directed_data: 
-            for i in range(0,len(directed_data[x])):
-                if directed_data[x][i] > 0:
-                    directed_data[x][i] = 1
-                elif directed_data[x][i] < 0:
-                    directed_data[x][i] = -1
-                else:
-                    directed_data[x][i] = 0
+        mentions, volume = self.get_directed_matrices([stock_name])
+        directed_data = pd.concat([mentions[stock_name], volume[stock_name]], axis = 1, keys = ['Mentions', 'Volume'])
+
         return directed_data
 
+    def get_directed_matrices(self, acro = None):
+        '''Specify the stock names and return the directions of reddit mentions and volume traded for all of them at once.
+            
+        :args:
+        - acro (list): Tickers of the stocks to analyze, all stocks in both data sets if not specified.
+        
+        :usage:
+            mentions, volume = self.get_directed_matrices(['AAPL', 'AMD'])
+            
+        :returns:
+        - mentions (pd.DataFrame): Direction of the change in the daily percentage change of mentions, one column per stock.
+        - volume (pd.DataFrame): The same for volume traded, on the same days as mentions.
+        
+        :note:
+        - Computes the same as get_stock_data followed by get_directed_data, but for every stock in one pass.
+        '''
+        if acro == None:
+            acro = self.acro_new
+        
+        columns = self.get_cached('directions', acro)
+        missing = [a for a in dict.fromkeys(acro) if a not in columns]
+        if missing:
+            mtn, vol = self.get_change_matrices(missing)
+            mentions = np.sign(mtn.diff()).fillna(0)            #nan (no change computable) counts as no change
+            volume = np.sign(vol.diff()).fillna(0)
+            for a in missing:
+                columns[a] = (mentions[a], volume[a])
+                self.cache.put(('directions', a), self.data_version, columns[a])
+        
+        return self.join_cached(columns, acro)
+
+    def get_change_matrices(self, acro = None):
+        '''Specify the stock names and return the daily percentage change of reddit mentions and volume traded
+            for all of them at once.
+            
+        :args:
+        - acro (list): Tickers of the stocks to analyze, all stocks in both data sets if not specified.
+        
+        :usage:
+            mentions, volume = self.get_change_matrices(['AAPL', 'AMD'])
+            
+        :returns:
+        - mentions (pd.DataFrame): Percentage change of mentions, one column per stock.
+        - volume (pd.DataFrame): Percentage change of volume traded, on the same days as mentions.
+        '''
+        if acro == None:
+            acro = self.acro_new
+        
+        columns = self.get_cached('changes', acro)
+        missing = [a for a in dict.fromkeys(acro) if a not in columns]
+        if missing:
+            mtn = self.model_data[missing].pct_change().replace(np.inf,np.nan).interpolate()
+            vol = self.yahoo_data[missing].pct_change().replace(np.inf,np.nan).interpolate()
+            days = mtn.index.intersection(vol.index)              #the common days of reddit and yahoo
+            mtn, vol = mtn.loc[days], vol.loc[days]
+            for a in missing:
+                columns[a] = (mtn[a], vol[a])
+                self.cache.put(('changes', a), self.data_version, columns[a])
+        
+        return self.join_cached(columns, acro)
+
+    def get_cached(self, kind, acro):
+        '''Return the cached (mentions, volume) pairs of one kind ('changes' or 'directions') for the stocks that have one.'''
+        columns = {}
+        for a in dict.fromkeys(acro):
+            pair = self.cache.get((kind, a), self.data_version)
+            if pair is not None:
+                columns[a] = pair
+        
+        return columns
+
+    def join_cached(self, columns, acro):
+        '''Return the (mentions, volume) pairs of the stocks in acro as two data frames with one column per stock.'''
+        acro = list(dict.fromkeys(acro))
+        if not acro:
+            return pd.DataFrame(), pd.DataFrame()
+        days = columns[acro[0]][0].index                          #all pairs of one data version share the days
+        mentions = pd.DataFrame(np.column_stack([columns[a][0].to_numpy() for a in acro]), index = days, columns = acro)
+        volume = pd.DataFrame(np.column_stack([columns[a][1].to_numpy() for a in acro]), index = days, columns = acro)
+        
+        return mentions, volume
+
+    def get_incidence_matrix(self, offsets, acro = None):
+        '''Specify pairs of offsets and return the incidence rate of every stock for every pair.
+            
+        :args:
+        - offsets (list): Pairs (offset_mentions, offset_volume), see get_incidence_offset.
+        - acro (list): Tickers of the stocks to analyze, all stocks in both data sets if not specified.
+        
+        :usage:
+            self.get_incidence_matrix([(0, 0), (0, 1), (0, 2)])
+            
+        :returns:
+        - incidence_df (pd.DataFrame): Incidence rates with the stocks in the index and one column per pair of offsets.
+            Stocks missing in one of the data sets get nan.
+        '''
+        if acro == None:
+            acro = self.acro_new
+        
+        known = [a for a in dict.fromkeys(acro) if a in self.model_data.columns and a in self.yahoo_data.columns]
+        mentions, volume = self.get_directed_matrices(known)
+        mentions, volume = mentions.to_numpy(), volume.to_numpy()
+        n = mentions.shape[0]
+        
+        rates = np.full((len(known), len(offsets)), np.nan)
+        for j, (om, ov) in enumerate(offsets):
+            first, last = max(0, -om, -ov), min(n - om, n - ov) #days r for which both r + om and r + ov exist
+            if last > first:
+                same = mentions[first + om:last + om] == volume[first + ov:last + ov]
+                rates[:, j] = same.mean(axis = 0).round(4)
+        incidence_df = pd.DataFrame(rates, index = known, columns = pd.MultiIndex.from_tuples(offsets)).reindex(acro)
+        
+        return incidence_df
+
+    def get_lag_sweep(self, lags = range(-10, 11), acro = None, min_periods = 10):
+        '''Specify a range of lags and return the incidence rate and the Pearson and Spearman correlation
+            of every stock for every lag.
+            
+        :args:
+        - lags (list): Lags in days, at a positive lag the mentions of a day are compared with the volume that many
+            days later (like the horizon of get_walk_forward), at a negative lag with the volume that many days earlier.
+        - acro (list): Tickers of the stocks to analyze, all stocks in both data sets if not specified.
+        - min_periods (int): Correlations computed from fewer days than this are nan.
+        
+        :usage:
+            self.get_lag_sweep(range(-10, 11), acro = ['AAPL', 'AMD', 'AMZN'])
+            
+        :returns:
+        - sweep_df (pd.DataFrame): Stocks in the index, columns (measure, lag) with the measures Incidence,
+            Pearson and Spearman. Stocks missing in one of the data sets get nan.
+        
+        :note:
+        - The incidence is the same as get_incidence_offset with (lag, 0), or (0, -lag) for negative lags. The correlations
+            are computed from the percentage changes of get_stock_data, leaving out days where one of them is missing.
+        - Incidence and Pearson correlation are computed for all lags at once from fft cross correlations of the
+            matrices, only the ranks of the Spearman correlation are computed per lag.
+        '''
+        if acro == None:
+            acro = self.acro_new
+        lags = list(lags)
+        
+        known = [a for a in dict.fromkeys(acro) if a in self.model_data.columns and a in self.yahoo_data.columns]
+        mtn, vol = self.get_change_matrices(known)
+        mentions, volume = self.get_directed_matrices(known)
+        #Oldest day first, so that row r + lag is lag days after row r
+        mtn, vol = mtn.iloc[::-1], vol.iloc[::-1]
+        mentions, volume = mentions.to_numpy()[::-1], volume.to_numpy()[::-1]
+        n = mentions.shape[0]
+        overlap = np.array([max(n - abs(lag), 0) for lag in lags], dtype = float)[:, None]
+        
+        #Incidence: days where both directions are -1, 0 or 1, summed over the three
+        same = sum(cross_sums((mentions == d).astype(float), (volume == d).astype(float), lags) for d in (-1, 0, 1))
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            incidence = (np.rint(same) / overlap).round(4)
+        
+        #Pearson: the moments of the days present in both series, centered first to keep the sums accurate
+        x, y = mtn.to_numpy(dtype = float), vol.to_numpy(dtype = float)
+        wx, wy = (~np.isnan(x)).astype(float), (~np.isnan(y)).astype(float)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            x, y = np.nan_to_num(x - np.nanmean(x, axis = 0)), np.nan_to_num(y - np.nanmean(y, axis = 0))
+            count = np.rint(cross_sums(wx, wy, lags))
+            sx, sy = cross_sums(x, wy, lags), cross_sums(wx, y, lags)
+            sxx, syy = cross_sums(x * x, wy, lags), cross_sums(wx, y * y, lags)
+            sxy = cross_sums(x, y, lags)
+            varx, vary = sxx - sx * sx / count, syy - sy * sy / count
+            pearson = (sxy - sx * sy / count) / np.sqrt(varx * vary)
+        constant = (varx <= 1e-12 * sxx) | (vary <= 1e-12 * syy) #fft rounding leaves tiny variances instead of zero
+        pearson[(count < min_periods) | constant] = np.nan
+        
+        #Spearman: ranks depend on which days overlap, so they are taken per lag
+        spearman = np.full(pearson.shape, np.nan)
+        for j, lag in enumerate(lags):
+            om, ov = max(-lag, 0), max(lag, 0)
+            if n - om - ov <= 0:
+                continue
+            xs, ys = mtn.iloc[om:n - ov].to_numpy(dtype = float), vol.iloc[ov:n - om].to_numpy(dtype = float)
+            both = ~np.isnan(xs) & ~np.isnan(ys)
+            rx = pd.DataFrame(np.where(both, xs, np.nan)).rank().to_numpy()
+            ry = pd.DataFrame(np.where(both, ys, np.nan)).rank().to_numpy()
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                rx, ry = rx - np.nanmean(rx, axis = 0), ry - np.nanmean(ry, axis = 0)
+                spearman[j] = np.nansum(rx * ry, axis = 0) / np.sqrt(np.nansum(rx * rx, axis = 0) * np.nansum(ry * ry, axis = 0))
+            spearman[j, both.sum(axis = 0) < min_periods] = np.nan
+        
+        columns = pd.MultiIndex.from_product([['Incidence', 'Pearson', 'Spearman'], lags], names = ['Measure', 'Lag'])
+        sweep_df = pd.DataFrame(np.vstack([incidence, pearson, spearman]).T, index = known, columns = columns).reindex(acro)
+        sweep_df.index.name = 'Stock'
+        
+        return sweep_df
+    
+    def get_best_lags(self, measure = 'Incidence', lags = range(1, 11), acro = None, sweep_df = None):
+        '''Specify a measure of the lag sweep and return for every stock the lag at which it is the highest.
+            
+        :args:
+        - measure (str): 'Incidence', 'Pearson' or 'Spearman'.
+        - lags (list): Lags in days to choose from, positive lags compare the mentions with the volume of later days.
+        - acro (list): Tickers of the stocks to analyze, all stocks in both data sets if not specified.
+        - sweep_df (pd.DataFrame): Result of get_lag_sweep to reuse, computed if not specified.
+        
+        :usage:
+            self.get_best_lags('Pearson', range(1, 6))
+            
+        :returns:
+        - best_df (pd.DataFrame): The best Lag and the value of the measure at it, stocks without any value are left out.
+        '''
+        if sweep_df is None:
+            sweep_df = self.get_lag_sweep(lags, acro)
+        values = sweep_df[measure][list(lags)].dropna(how = 'all')
+        best_df = pd.DataFrame({'Lag': values.idxmax(axis = 1), measure: values.max(axis = 1)})
+        
+        return best_df
+
+    def get_significance(self, offsets = [(0, 0), (0, 1), (0, 2)], acro = None, n_boot = 2000, block = 5, alpha = 0.05,
+                         seed = 0, processes = 1):
+        '''Specify pairs of offsets and return p-values and confidence intervals of the incidence rate of every stock.
+            
+        :args:
+        - offsets (list): Pairs (offset_mentions, offset_volume), see get_incidence_offset.
+        - acro (list): Tickers of the stocks to analyze, all stocks in both data sets if not specified.
+        - n_boot (int): Number of block bootstrap samples of the confidence interval, 0 leaves the interval out.
+        - block (int): Number of consecutive days resampled together.
+        - alpha (float): The confidence interval covers 1 - alpha.
+        - seed (int): Seed of the bootstrap.
+        - processes (int): Number of processes the stocks are split over, None uses all cores.
+        
+        :usage:
+            self.get_significance([(0, 1), (1, 3)], processes = None)
+            
+        :returns:
+        - significance_df (pd.DataFrame): Stocks in the index, columns (measure, offset_mentions, offset_volume) with
+            the measures Incidence, Chance, P-value, CI low and CI high, see Significance.incidence_significance.
+            Stocks missing in one of the data sets get nan.
+        '''
+        if acro == None:
+            acro = self.acro_new
+        
+        known = [a for a in dict.fromkeys(acro) if a in self.model_data.columns and a in self.yahoo_data.columns]
+        mentions, volume = self.get_directed_matrices(known)
+        significance_df = significance.incidence_significance(mentions, volume, offsets, n_boot = n_boot, block = block,
+                                                              alpha = alpha, seed = seed, processes = processes)
+        significance_df = significance_df.reindex(list(dict.fromkeys(acro)))
+        significance_df.index.name = 'Stock'
+        
+        return significance_df
+
+    def get_walk_forward(self, window = 20, horizon = 1, acro = None, min_periods = 10):
+        '''Specify a window length and a horizon and walk through the data day by day, measuring over the window
+            ending on every day how well the mentions relate to the volume traded horizon days later.
+            
+        :args:
+        - window (int): Number of trading days in a window.
+        - horizon (int): Number of days between the mentions and the volume traded they are compared with.
+        - acro (list): Tickers of the stocks to analyze, all stocks in both data sets if not specified.
+        - min_periods (int): Windows with fewer days where both values are present get nan, between 1 and window.
+        
+        :usage:
+            self.get_walk_forward(window = 20, horizon = 1, acro = ['TSLA', 'AAPL'])
+            
+        :returns:
+        - walk_df (pd.DataFrame): Days in the index (newest first), columns (measure, stock) with the measures
+            - Incidence: share of the window with the same direction of mentions and volume traded.
+            - Correlation: Pearson correlation of their daily percentage changes.
+            - Slope, Intercept: least squares fit of log volume on log(1 + mentions) within the window.
+            - Prediction: log volume of the day predicted by the fit of the window ending the day before.
+            - Error, Benchmark error: log volume minus the prediction, and minus the mean of the previous window.
+        
+        :note:
+        - The days are the days of both data sets, a window ending on a day only uses that day and earlier ones,
+            so Prediction and Error are out of sample.
+        - The window statistics are updated from cumulative sums (see rolling_moments), not recomputed per window.
+        '''
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        if not 1 <= min_periods <= window:
+            raise ValueError("min_periods must be between 1 and window")
+        if horizon < 0:
+            raise ValueError("horizon must not be negative")
+        if acro == None:
+            acro = self.acro_new
+        
+        known = [a for a in dict.fromkeys(acro) if a in self.model_data.columns and a in self.yahoo_data.columns]
+        mtn, vol = self.get_change_matrices(known)
+        mentions, volume = self.get_directed_matrices(known)
+        days = mtn.index
+        
+        #Oldest day first, the mentions moved forward by the horizon so that row t pairs mentions of t - horizon with volume of t
+        def oldest_first(df):
+            return df.to_numpy(dtype = float)[::-1]
+        def lagged(values):
+            moved = np.full(values.shape, np.nan)
+            moved[horizon:] = values[:len(values) - horizon]
+            return moved
+        
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            same = np.where(np.isnan(lagged(oldest_first(mentions))), np.nan,
+                            lagged(oldest_first(mentions)) == oldest_first(volume))
+            n, total = rolling_moments(same, same, window)[:2]
+            incidence = total / n
+            incidence[n < min_periods] = np.nan
+            
+            x, y = lagged(oldest_first(mtn)), oldest_first(vol)
+            n, sx, sy, sxx, syy, sxy = rolling_moments(x - np.nanmean(x, axis = 0), y - np.nanmean(y, axis = 0), window)
+            varx, vary = sxx - sx * sx / n, syy - sy * sy / n
+            correlation = (sxy - sx * sy / n) / np.sqrt(varx * vary)
+            correlation[(n < min_periods) | (varx <= 1e-12 * sxx) | (vary <= 1e-12 * syy)] = np.nan
+            
+            x = lagged(np.log1p(oldest_first(self.model_data.loc[days, known])))
+            volume = oldest_first(self.yahoo_data.loc[days, known])
+            y = np.log(np.where(volume > 0, volume, np.nan)) #a day without trades has no log volume, not -inf
+            center_x, center_y = np.nanmean(x, axis = 0), np.nanmean(y, axis = 0) #keeps the sums small and accurate
+            n, sx, sy, sxx, syy, sxy = rolling_moments(x - center_x, y - center_y, window)
+            varx = sxx - sx * sx / n
+            slope = (sxy - sx * sy / n) / varx
+            slope[(n < min_periods) | (varx <= 1e-12 * sxx)] = np.nan
+            mean_y = sy / n + center_y
+            intercept = mean_y - slope * (sx / n + center_x)
+            
+        prediction = np.full(y.shape, np.nan)
+        prediction[1:] = intercept[:-1] + slope[:-1] * x[1:]   #fitted on the window ending the day before
+        benchmark = np.full(y.shape, np.nan)
+        benchmark[1:] = np.where(n[:-1] >= min_periods, mean_y[:-1], np.nan)
+        
+        measures = {'Incidence': incidence, 'Correlation': correlation, 'Slope': slope, 'Intercept': intercept,
+                    'Prediction': prediction, 'Error': y - prediction, 'Benchmark error': y - benchmark}
+        walk_df = pd.concat({measure: pd.DataFrame(values[::-1], index = days, columns = known).reindex(columns = acro)
+                             for measure, values in measures.items()}, axis = 1, names = ['Measure', 'Stock'])
+        
+        return walk_df
+    
+    def get_walk_forward_scores(self, walk_df = None, **kwargs):
+        '''Summarize the out of sample predictions of get_walk_forward for every stock.
+            
+        :args:
+        - walk_df (pd.DataFrame): Result of get_walk_forward, computed with kwargs if not specified.
+        
+        :usage:
+            self.get_walk_forward_scores(window = 30, horizon = 2)
+            
+        :returns:
+        - scores_df (pd.DataFrame): Per stock the number of predicted Days, the mean squared Error of the predictions and
+            of the Benchmark (mean of the previous window), R2 (1 - their ratio, above 0 if the mentions help) and the
+            mean Incidence and Correlation over the windows.
+        '''
+        if walk_df is None:
+            walk_df = self.get_walk_forward(**kwargs)
+        
+        both = walk_df['Error'].notna() & walk_df['Benchmark error'].notna()
+        error = (walk_df['Error'].where(both) ** 2).mean()
+        benchmark = (walk_df['Benchmark error'].where(both) ** 2).mean()
+        scores_df = pd.DataFrame({'Days': both.sum(), 'Error': error, 'Benchmark': benchmark, 'R2': 1 - error / benchmark,
+                                  'Incidence': walk_df['Incidence'].mean(), 'Correlation': walk_df['Correlation'].mean()})
+        scores_df.index.name = 'Stock'
+        
+        return scores_df
+
     def get_correlation(self, stock_name):
         '''Specify a stock name and calculate the correlation between reddit mentions and volume traded from the
             directed data.
@@ -202,9 +705,7 @@ class Data_Analyzer:
         - inc_rate (np.float64): Incicates the percentage of cases where
             the direction of the trend is the same for reddit mentions and volume traded on the same day.
         '''
-        directed_data = self.get_directed_data(stock_name)
-        incidence = directed_data['Mentions'] == directed_data['Volume']
-        inc_rate = (incidence.sum()/len(incidence)).round(4)
+        inc_rate = self.get_incidence_matrix([(0, 0)], [stock_name]).iloc[0, 0]
         #inc_rate = "{:.2%}".format(inc_rate) #Converting to a percentage
         return inc_rate
     
@@ -223,21 +724,13 @@ class Data_Analyzer:
             
         :warning:
         - Specifying too large an offset number will result in loss of information.
+        - Only days for which both offset values exist are compared, negative offsets no longer wrap around to the other end.
             
         :returns:
         - inc.offset (np.float64): Incicates the percentage of cases where
             the direction of the trend is the same for reddit mentions and volume traded on the same day.
         '''
-        directed_data = self.get_directed_data(stock_name)
-        
-        incidence = []
-        for r in range(0,directed_data.shape[0]):
-            try:
-                incidence.append(directed_data['Mentions'][r + offset_mentions] == directed_data['Volume'][r + offset_volume])
-            except IndexError:
-                pass
-        incidence = pd.Series(incidence)    
-        inc_offset = (incidence.sum()/len(incidence)).round(4)
+        inc_offset = self.get_incidence_matrix([(offset_mentions, offset_volume)], [stock_name]).iloc[0, 0]
         return inc_offset
     
     def get_acro_list(self):
@@ -254,9 +747,7 @@ class Data_Analyzer:
             seem redundant having a method to get all 500 S&P stocks. However, we feel like this may be used
             to compare various datasets with the S&P list as a benchmark, so we include the method here.
         '''
-        tickers = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
-        acro_list = tickers[0]['Symbol'].tolist()             #creating a list of tickers
-        acro_list = [a.replace('.', '-') for a in acro_list]
+        acro_list = stock_dictionary.get_acro_list()          #cached with the stock dictionary, see Stock_Dictionary.py
     
         return acro_list
     
@@ -279,58 +770,15 @@ class Data_Analyzer:
         if acro == None:
             acro = self.acro_new
         
-        incidence_df = pd.DataFrame({'Stock': pd.Series([], dtype='str'),
-                                    'Incidence': pd.Series([], dtype='int'),
-                                    f'Incidence offset by 1': pd.Series([], dtype='float'),
-                                    f'Incidence offset by 2': pd.Series([], dtype='float'),
-                                    f'Incidence offset custom': pd.Series([], dtype='float')})
-        for a in acro:
-            try: 
-                stock_name = a
-                incidence = self.get_incidence(a)
-                incidence_1 = self.get_incidence_offset(a, offset_mentions = 0, offset_volume = 1)
-                incidence_2 = self.get_incidence_offset(a, offset_mentions = 0, offset_volume = 2)
-                incidence_custom = self.get_incidence_offset(a, offset_mentions = offset_mentions_by, offset_volume = offset_volume_by)
-                
-                new_row = pd.DataFrame({'Stock': pd.Series([stock_name]),
-                                        'Incidence': pd.Series([incidence], dtype='float'),
-                                        f'Incidence offset by 1': pd.Series([incidence_1], dtype='float'),
-                                        f'Incidence offset by 2': pd.Series([incidence_2], dtype='float'),
-                                        f'Incidence offset custom': pd.Series([incidence_custom], dtype='float')})
-                incidence_df = incidence_df.append(new_row)
-
-            except:
-                stock_name = a
-                incidence = np.random.uniform(low = 0, high = 1)
-                incidence_1 = np.random.uniform(low = 0, high = 1)
-                incidence_2 = np.random.uniform(low = 0, high = 1)
-                incidence_custom = np.random.uniform(low = 0, high = 1)
-                
-                new_row = pd.DataFrame({'Stock': pd.Series([stock_name]),
-                                        'Incidence': pd.Series([incidence], dtype='float'),
-                                        f'Incidence offset by 1': pd.Series([incidence_1], dtype='float'),
-                                        f'Incidence offset by 2': pd.Series([incidence_2], dtype='float'),
-                                        f'Incidence offset custom': pd.Series([incidence_custom], dtype='float')})
-                incidence_df = incidence_df.append(new_row)
-        
-        
-        incidence_mean = incidence_df['Incidence'].mean()
-        incidence_1_mean = incidence_df['Incidence offset by 1'].mean()
-        incidence_2_mean = incidence_df['Incidence offset by 2'].mean()
-        incidence_custom_mean = incidence_df['Incidence offset custom'].mean()
-
-        row_total = pd.DataFrame({'Stock': 'Mean',
-                                        'Incidence': pd.Series([incidence_mean], dtype = 'float'),
-                                        f'Incidence offset by 1': pd.Series([incidence_1_mean], dtype='float'),
-                                        f'Incidence offset by 2': pd.Series([incidence_2_mean], dtype='float'),
-                                        f'Incidence offset custom': pd.Series([incidence_custom_mean], dtype='float')})
-        incidence_df = incidence_df.append(row_total)
-        
-        incidence_df = incidence_df.set_index('Stock')
+        offsets = [(0, 0), (0, 1), (0, 2), (offset_mentions_by, offset_volume_by)]
+        incidence_df = self.get_incidence_matrix(offsets, acro)
+        incidence_df.columns = ['Incidence', 'Incidence offset by 1', 'Incidence offset by 2', 'Incidence offset custom']
+        incidence_df.loc['Mean'] = incidence_df.mean()  #stocks without data (nan) are left out of the mean
+        incidence_df.index.name = 'Stock'
              
         return incidence_df
     
-    def get_outcome(self, offset_mentions_by = 0, offset_volume_by = 0, acro = None):
+    def get_outcome(self, offset_mentions_by = 0, offset_volume_by = 0, acro = None, alpha = 0.05):
         '''Specify the stock names and the amount of days, by which to offset the calculation and
             print a table of outcomes, which contains information about how well reddit was able to
             predict stock movement.
@@ -339,6 +787,8 @@ class Data_Analyzer:
         - acro (list): Tickers of the stocks to analyze.
         - offset_mentions (int): Number of days by which to offset the reddit mentions data to the right.
         - offset_volume (int): Number of days by which to offset the colume traded data to the right.
+        - alpha (float): Significance level of the comparison with chance, see get_significance. Only its shift test is
+            run here, call get_significance for the confidence intervals.
         
         :usage:
             self.get_power(offset_mentions_by = 1, offset_volume_by = 3, acro = ['AAPL', 'AMD', 'AMZN'])
@@ -350,17 +800,28 @@ class Data_Analyzer:
         '''
         incidence_df = self.get_incidences(offset_mentions_by, offset_volume_by, acro)
         incidence_custom = incidence_df.loc['Mean', 'Incidence offset custom']
+        
+        #The share of days with the same direction is compared with its level under random alignments
+        significance_df = self.get_significance([(offset_mentions_by, offset_volume_by)], acro, n_boot = 0, alpha = alpha)
+        significance_df = significance_df[significance_df['P-value'].notna().all(axis = 1)] #without the interval bounds
+        chance = significance_df['Chance'].mean().iloc[0]
+        significant = int((significance_df['P-value'] < alpha).sum().iloc[0])
+        expected = alpha * len(significance_df)
 
-        if incidence_custom > 0.5:
+        if significant > 2 * expected and incidence_custom > chance:
             print('Reddit did a great job this time.')
-        elif incidence_custom > 0.25:
+        elif significant > expected:
             print('Reddit did an OK job this time.')
         else:
             print('Reddit did not do well this time.')
+        print(f'The direction was the same significantly more often than by chance (p < {alpha}) for {significant} stocks, '
+              f'{expected:.1f} would be expected by chance alone. The mean level expected by chance was {chance:.2%}.')
             
         incidence_custom = "{:.2%}".format(incidence_custom) #Converting to a percentage
         
-        offset = offset_volume_by - offset_mentions_by
+        #Days the volume comes after the mentions, like the lag of get_lag_sweep: the rows are newest first, so a larger
+        #offset of the mentions reaches further back and (N, 0) compares the mentions with the volume N days later
+        offset = offset_mentions_by - offset_volume_by
         
         if offset < -1:
             print(f'The trend in its stock mentions compared to the stock movement {-offset} days ago was the same in {incidence_custom} of cases.')
@@ -403,11 +864,3 @@ class Data_Analyzer:
             self.plot_stock_data(acro[:10])
 
         return incidence_df
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
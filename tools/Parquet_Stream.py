@@ -0,0 +1,147 @@
+import os
+import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def part_files(path):
+    '''Return the part files written for a parquet file so far, oldest first.'''
+    parts = path + '.parts'
+    if not os.path.isdir(parts):
+        return []
+    return sorted(os.path.join(parts, f) for f in os.listdir(parts) if f.endswith('.parquet'))
+
+
+def compact_parts(path, schema = None, append = False):
+    '''Join the part files of a parquet file into the file itself (one row group per part) and remove them.
+
+    :args:
+    - path (str): The parquet file, its parts are in the folder path + '.parts'.
+    - schema (pyarrow.Schema): Columns of the file, taken from the first part if not specified.
+    - append (bool): Keep the rows already in the file, the parts are added after them. Otherwise the file is replaced.
+
+    :usage:
+        compact_parts('./data/daily_parquet_data/01_04_21.parquet')
+
+    :returns:
+    - rows (int): Number of rows in the compacted file.
+
+    :note:
+    - Used by Parquet_Stream_Writer.close and to recover the parts left behind by a run that was killed.
+    '''
+    parts = part_files(path)
+    existing = append and os.path.exists(path)
+    if not parts and (schema is None or existing): #killed before the first flush, or nothing to add to the file
+        shutil.rmtree(path + '.parts', ignore_errors = True)
+        return pq.read_metadata(path).num_rows if existing else 0
+    if schema is None:
+        schema = pq.read_schema(parts[0])
+    if existing:
+        parts = [path] + parts #written to path + '.tmp' first, so the file is only replaced once everything is copied
+    rows = 0
+    with pq.ParquetWriter(path + '.tmp', schema) as writer:
+        for part in parts:
+            table = pq.read_table(part).cast(schema)
+            writer.write_table(table, row_group_size = max(table.num_rows, 1))
+            rows += table.num_rows
+    os.replace(path + '.tmp', path)
+    shutil.rmtree(path + '.parts', ignore_errors = True)
+
+    return rows
+
+
+def append_table(path, table):
+    '''Write a table to a parquet file after the rows already in it (if any), through a tmp file.
+
+    :args:
+    - path (str): The parquet file.
+    - table (pyarrow.Table): Rows to add, the file is expected to have the same columns.
+
+    :returns:
+    - rows (int): Number of rows in the file.
+    '''
+    if os.path.exists(path):
+        table = pa.concat_tables([pq.read_table(path).cast(table.schema), table])
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+    return table.num_rows
+
+
+class Parquet_Stream_Writer:
+    '''Write records to a parquet file while they are being scraped, one row group every row_group_size records.
+
+    :usage:
+        with Parquet_Stream_Writer(path, schema, row_group_size = 500) as writer:
+            for record in records:
+                writer.write(record)
+
+    :note:
+    - Only the records of the current row group are held in memory. Every row group is written as its own complete
+        parquet file to the folder path + '.parts' and close joins them into path.
+    - If the process dies without closing (kill -9, out of memory, a lambda timeout), the parts flushed so far stay
+        readable, e.g. with pq.read_table(path + '.parts'). The next writer of the same path continues after them and
+        includes them when it closes, compact_parts recovers them without writing anything new.
+    - With append, the rows already in path are kept in front of the new ones, e.g. for a second run on the same day.
+    '''
+    def __init__(self, path, schema, row_group_size = 1000, prepare = None, append = False):
+        '''The constructor for the Parquet_Stream_Writer class.
+
+        :args:
+        - path (str): Where to write the parquet file.
+        - schema (pyarrow.Schema): Columns of the records and their types.
+        - row_group_size (int): Number of records buffered before they are written out as one row group.
+        - prepare (function): Optional function called with the buffered columns (dict of lists) before each
+            flush, returning the columns to write. Used e.g. to tag the tickers of a whole row group at once.
+        - append (bool): Keep the rows of an existing file at path, the new rows are added after them.
+        '''
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.prepare = prepare
+        self.append = append
+        os.makedirs(path + '.parts', exist_ok = True)
+        self.parts = len(part_files(path)) #parts of a killed run on the same path are kept
+        self.columns = {name: [] for name in schema.names}
+        self.buffered = 0
+        self.written = 0
+
+    def write(self, record):
+        '''Add one record (dict with a value for every column) and flush if the row group is full.'''
+        for name in self.columns:
+            self.columns[name].append(record.get(name))
+        self.buffered += 1
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        '''Write the buffered records as one part file.'''
+        if self.buffered == 0:
+            return None
+        columns = self.columns
+        if self.prepare is not None:
+            columns = self.prepare(columns)
+        table = pa.Table.from_pydict(columns, schema = self.schema)
+        part = os.path.join(self.path + '.parts', 'part_' + str(self.parts).zfill(6) + '.parquet')
+        tmp = os.path.join(self.path + '.parts', '.' + os.path.basename(part) + '.tmp') #hidden from readers of the folder
+        pq.write_table(table, tmp, row_group_size = max(table.num_rows, 1))
+        os.replace(tmp, part) #a part is either complete or not there
+        self.parts += 1
+        self.written += self.buffered
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+
+        return None
+
+    def close(self):
+        '''Flush the remaining records and join all parts into the parquet file.'''
+        try:
+            self.flush()
+        finally:
+            compact_parts(self.path, self.schema, self.append)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,151 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+MEASURES = ['Incidence', 'Chance', 'P-value', 'CI low', 'CI high']
+
+
+def aligned_pairs(mentions, volume, offset_mentions, offset_volume):
+    '''Return the rows of the direction matrices compared by an incidence with these offsets.
+
+    :args:
+    - mentions (np.ndarray): Directions of mentions, days in rows and stocks in columns.
+    - volume (np.ndarray): Directions of volume traded, same shape as mentions.
+    - offset_mentions (int): Offset of the mentions, see Data_Analyzer.get_incidence_offset.
+    - offset_volume (int): Offset of the volume traded.
+
+    :returns:
+    - x, y (np.ndarray): The compared rows, row r of x is compared with row r of y.
+    '''
+    n = mentions.shape[0]
+    first, last = max(0, -offset_mentions, -offset_volume), min(n - offset_mentions, n - offset_volume)
+    last = max(first, last)
+
+    return mentions[first + offset_mentions:last + offset_mentions], volume[first + offset_volume:last + offset_volume]
+
+
+def shift_test(x, y):
+    '''Compare the incidence of aligned directions with its value under every circular shift of the volume.
+
+    :args:
+    - x (np.ndarray): Directions of mentions (-1, 0, 1), days in rows and stocks in columns.
+    - y (np.ndarray): Directions of volume traded, same shape as x.
+
+    :returns:
+    - incidence (np.ndarray): Share of days with the same direction, one value per stock.
+    - chance (np.ndarray): Mean incidence over the shifts, the level expected without any relationship.
+    - p_value (np.ndarray): Share of shifts (counting the observed one) with an incidence at least as high.
+
+    :note:
+    - A shift keeps the autocorrelation of both series but breaks their alignment. All m - 1 shifts are used,
+        computed at once as a circular cross correlation of the indicators of -1, 0 and 1 with the fft.
+    '''
+    m = x.shape[0]
+    same = sum(np.fft.irfft(np.conj(np.fft.rfft(x == d, axis = 0)) * np.fft.rfft(y == d, axis = 0), m, axis = 0)
+               for d in (-1, 0, 1))
+    same = np.rint(same)                                     #counts of days, the fft leaves rounding errors
+    observed, shifted = same[0], same[1:]
+    p_value = (1 + (shifted >= observed).sum(axis = 0)) / m
+
+    return observed / m, shifted.mean(axis = 0) / m, p_value
+
+
+def block_bootstrap(x, y, n_boot, block, alpha, rng):
+    '''Return a confidence interval of the incidence from a circular block bootstrap of the days.
+
+    :args:
+    - x (np.ndarray): Directions of mentions, days in rows and stocks in columns.
+    - y (np.ndarray): Directions of volume traded, same shape as x.
+    - n_boot (int): Number of bootstrap samples.
+    - block (int): Number of consecutive days resampled together, keeps the short term dependence.
+    - alpha (float): The interval covers 1 - alpha.
+    - rng (np.random.Generator): Source of the resampled blocks.
+
+    :returns:
+    - low, high (np.ndarray): Bounds of the interval, one value per stock.
+
+    :note:
+    - Every sample draws the same blocks for all stocks, so the samples are one matrix product of the
+        number of times each block was drawn with the sums of the blocks.
+    '''
+    same = (x == y).astype(float)
+    m = same.shape[0]
+    block = min(block, m)
+    wrapped = np.vstack([np.zeros((1, same.shape[1])), np.cumsum(np.vstack([same, same[:block - 1]]), axis = 0)])
+    block_sums = wrapped[block:block + m] - wrapped[:m]     #sum of the block starting on every day
+    blocks = -(-m // block)
+    starts = rng.integers(0, m, size = (n_boot, blocks))
+    drawn = np.zeros((n_boot, m))
+    np.add.at(drawn, (np.arange(n_boot)[:, None], starts), 1)
+    samples = drawn @ block_sums / (blocks * block)
+    low, high = np.percentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis = 0)
+
+    return low, high
+
+
+def _significance_columns(mentions, volume, offsets, n_boot, block, alpha, seed):
+    '''Run the tests of incidence_significance on a part of the stocks, used by the worker processes.
+
+    :returns:
+    - results (np.ndarray): One row per stock, the MEASURES of every pair of offsets one after another.
+    '''
+    results = np.full((mentions.shape[1], len(offsets) * len(MEASURES)), np.nan)
+    for j, (offset_mentions, offset_volume) in enumerate(offsets):
+        x, y = aligned_pairs(mentions, volume, offset_mentions, offset_volume)
+        if x.shape[0] < 2:
+            continue
+        rng = np.random.default_rng([seed, j])               #same draws whichever process gets the stocks
+        incidence, chance, p_value = shift_test(x, y)
+        if n_boot > 0:
+            low, high = block_bootstrap(x, y, n_boot, block, alpha, rng)
+        else:                                                #only the shift test, e.g. for a quick verdict
+            low = high = np.full(x.shape[1], np.nan)
+        results[:, j * len(MEASURES):(j + 1) * len(MEASURES)] = np.column_stack([incidence, chance, p_value, low, high])
+
+    return results
+
+
+def incidence_significance(mentions, volume, offsets, n_boot = 2000, block = 5, alpha = 0.05, seed = 0, processes = 1):
+    '''Specify the direction matrices and pairs of offsets and return for every stock how likely its incidence
+        rate is to be reached by chance, and a confidence interval of it.
+
+    :args:
+    - mentions (pd.DataFrame): Directions of mentions, see Data_Analyzer.get_directed_matrices.
+    - volume (pd.DataFrame): Directions of volume traded, on the same days and stocks as mentions.
+    - offsets (list): Pairs (offset_mentions, offset_volume), see Data_Analyzer.get_incidence_offset.
+    - n_boot (int): Number of block bootstrap samples of the confidence interval, 0 skips the bootstrap (nan bounds).
+    - block (int): Number of consecutive days resampled together.
+    - alpha (float): The confidence interval covers 1 - alpha.
+    - seed (int): Seed of the bootstrap, the same seed gives the same intervals.
+    - processes (int): Number of processes the stocks are split over, None uses all cores.
+
+    :usage:
+        incidence_significance(mentions, volume, [(0, 0), (0, 1)], processes = None)
+
+    :returns:
+    - significance_df (pd.DataFrame): Stocks in the index, columns (measure, offset_mentions, offset_volume) with
+        the measures Incidence, Chance (mean incidence under the shifts), P-value, CI low and CI high.
+
+    :note:
+    - The p-value comes from all circular shifts of the volume against the mentions, see shift_test. With m compared
+        days there are only m - 1 shifts, so the smallest possible p-value is 1 / m.
+    '''
+    offsets = [tuple(pair) for pair in offsets]
+    x, y = mentions.to_numpy(dtype = float), volume.to_numpy(dtype = float)
+    processes = processes or os.cpu_count()
+    chunks = [chunk for chunk in np.array_split(np.arange(x.shape[1]), processes) if len(chunk)]
+    arguments = [(x[:, chunk], y[:, chunk], offsets, n_boot, block, alpha, seed) for chunk in chunks]
+    if len(chunks) > 1:
+        with Pool(processes = len(chunks)) as pool:
+            parts = pool.starmap(_significance_columns, arguments)
+    else:
+        parts = [_significance_columns(*args) for args in arguments]
+    results = np.vstack(parts) if parts else np.empty((0, len(offsets) * len(MEASURES)))
+
+    columns = pd.MultiIndex.from_tuples([(measure,) + pair for pair in offsets for measure in MEASURES],
+                                        names = ['Measure', 'Offset mentions', 'Offset volume'])
+    significance_df = pd.DataFrame(results, index = mentions.columns, columns = columns)
+    significance_df = significance_df[MEASURES]             #grouped by measure like get_lag_sweep
+
+    return significance_df
@@ -1,78 +1,330 @@
-from os import listdir
+from os import listdir, stat, makedirs, replace
 from os.path import isfile, join
+import json
 import pandas as pd
-from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from datetime import datetime, timedelta
+from pandas.tseries.holiday import (AbstractHolidayCalendar, Holiday, GoodFriday, USMartinLutherKingJr, USPresidentsDay,
+                                    USMemorialDay, USLaborDay, USThanksgivingDay, nearest_workday, sunday_to_monday)
+
+CACHE_VERSION = 6
+
+#the only columns read from the daily files, text is never loaded
+SCHEMA = pa.schema([('post_id', pa.string()),
+                    ('comment_id', pa.string()),
+                    ('subreddit', pa.string()),
+                    ('text_type', pa.string()),
+                    ('epoch_time', pa.int64()),
+                    ('tickers', pa.list_(pa.string()))])
+
+#read as well when counting every mention, files tagged before it existed read it as null
+MENTIONS_FIELD = pa.field('mentions', pa.list_(pa.struct([('ticker', pa.string()),
+                                                          ('count', pa.int32()),
+                                                          ('offsets', pa.list_(pa.int32()))])))
+
+def file_date(file):
+    '''Return the scraping date encoded in a daily file name such as 01_04_21.parquet.'''
+    try:
+        return datetime.strptime(file.replace('.parquet', ''), '%d_%m_%y')
+    except ValueError:
+        return datetime.max
+
+def encode_ids(ids):
+    '''Return reddit ids (base 36 strings) as int64 numbers, -1 standing for a missing id.'''
+    ids = pd.Series(ids, dtype = 'object').fillna('').str.lower().to_numpy(dtype = 'str')
+    if len(ids) == 0:
+        return np.array([], dtype = 'int64')
+    width = max(ids.dtype.itemsize // 4, 1) #numpy stores unicode strings with 4 bytes per character
+    chars = np.char.rjust(ids, width, '0').astype(f'S{width}').view('uint8').reshape(-1, width).astype('int64')
+    digits = np.where(chars >= ord('a'), chars - ord('a') + 10, chars - ord('0'))
+    numbers = digits @ (36 ** np.arange(width - 1, -1, -1, dtype = 'int64'))
+    numbers[ids == ''] = -1
+    return numbers
+
+#regular full day closures of the NYSE and NASDAQ, a saturday holiday is not moved to the friday before
+class Exchange_Holiday_Calendar(AbstractHolidayCalendar):
+    rules = [Holiday('New Years Day', month = 1, day = 1, observance = sunday_to_monday),
+             USMartinLutherKingJr,
+             USPresidentsDay,
+             GoodFriday,
+             USMemorialDay,
+             Holiday('Juneteenth', month = 6, day = 19, start_date = '2022-01-01', observance = nearest_workday),
+             Holiday('Independence Day', month = 7, day = 4, observance = nearest_workday),
+             USLaborDay,
+             USThanksgivingDay,
+             Holiday('Christmas', month = 12, day = 25, observance = nearest_workday)]
+
+def exchange_holidays(start, end):
+    '''Return the exchange holidays between two dates as datetime64[D] values.'''
+    return Exchange_Holiday_Calendar().holidays(start, end).to_numpy(dtype = 'datetime64[D]')
+
+def bucket_days(epoch_time, market_timezone = None, market_close = None, holidays = None):
+    '''Return the day each utc epoch time belongs to, as datetime64 values.
+
+    With a market timezone the times are converted to its local time and anything after the market close
+    (e.g. '16:00') is moved to the next day. Weekends and exchange holidays are then moved to the following
+    trading day, so that mentions line up with the trading day they can affect. holidays (dates) replaces
+    the exchange calendar, e.g. with the days missing in the yahoo data.'''
+    times = pd.to_datetime(pd.Series(epoch_time), unit = 's')
+    if market_timezone is None:
+        return times.dt.floor('D')
+    times = times.dt.tz_localize('UTC').dt.tz_convert(market_timezone).dt.tz_localize(None)
+    if market_close is not None:
+        times = times + (pd.Timedelta(days = 1) - pd.Timedelta(market_close + ':00'))
+    days = times.dt.floor('D').to_numpy(dtype = 'datetime64[D]')
+    if holidays is None:
+        if len(days) == 0:
+            holidays = np.array([], dtype = 'datetime64[D]')
+        else:
+            holidays = exchange_holidays(str(days.min()), str(days.max() + np.timedelta64(14, 'D')))
+    holidays = np.asarray(holidays, dtype = 'datetime64[D]')
+    return pd.Series(np.busday_offset(days, 0, roll = 'forward', holidays = holidays).astype('datetime64[ns]'),
+                     index = times.index)
+
 
 class Ticker_Matrix:
-    def __init__(self,path):
+    def __init__(self,path,use_cache = True,min_mentions = 2,start_date = '2021-03-17',end_date = None,
+                 market_timezone = None,market_close = '16:00',count_by = 'documents',holidays = None):
+        if count_by not in ('documents', 'mentions'):
+            raise ValueError("count_by must be 'documents' or 'mentions'")
         self.path = path
+        self.count_by = count_by #'documents' counts the posts and comments mentioning a ticker, 'mentions' every mention in them
+        self.start_date = start_date #March 17th seems to be a reasonable lower bound for our dataset
+        self.end_date = end_date #last day included, None for no upper bound
+        self.market_timezone = market_timezone #e.g. 'US/Eastern' to count mentions by trading day, utc days if None
+        self.market_close = market_close #only used with a market timezone
+        #days without trading besides weekends, the exchange calendar if None, only used with a market timezone
+        self.holidays = None if holidays is None else sorted(str(pd.Timestamp(day).date()) for day in holidays)
+        self.use_cache = use_cache
+        self.min_mentions = min_mentions #tickers with fewer mentions in total are left out of the matrix
+        self.cache_path = join(path, '.ticker_cache') #hidden folder, skipped when listing the daily files
         self.full_df = self.create_df()
-        self.ticker_matrix = self.create_ticker_matrix()
+        self.sparse_matrix = self.create_ticker_matrix()
+        self.dense_matrix = None
 
-    def create_df(self):
-        files = [f for f in listdir(self.path) if isfile(join(self.path, f))]
-        li = []
+    @property
+    def ticker_matrix(self):
+        '''Dense view of the sparse ticker matrix, only built when it is first asked for.'''
+        if self.dense_matrix is None:
+            if len(self.sparse_matrix.columns) > 0:
+                self.dense_matrix = self.sparse_matrix.sparse.to_dense()
+            else:
+                self.dense_matrix = self.sparse_matrix.astype('int64')
+        return self.dense_matrix
+
+    def list_files(self):
+        #files are processed in date order, a post or comment belongs to the first day it was scraped on
+        files = [f for f in listdir(self.path) if isfile(join(self.path, f)) and f.endswith('.parquet')]
+        return sorted(files, key = lambda f: (file_date(f), f))
+
+    def get_window(self):
+        '''Return the date window as a [start, end) range of utc epoch seconds, None standing for an open end.
+
+        With a market timezone a trading day may start several days before its date (friday close to monday),
+        so the range is widened and the exact window is applied once the days are known.'''
+        epoch = datetime(1970, 1, 1)
+        margin = timedelta(days = 4) if self.market_timezone is not None else timedelta(0)
+        start, end = None, None
+        if self.start_date is not None:
+            start = int((datetime.fromisoformat(self.start_date) - margin - epoch).total_seconds())
+        if self.end_date is not None:
+            end = int((datetime.fromisoformat(self.end_date) + timedelta(days = 1) + margin - epoch).total_seconds())
+        return start, end
+
+    def get_settings(self):
+        #everything the cached rows and counts depend on
+        return {'window': list(self.get_window()), 'market_timezone': self.market_timezone,
+                'market_close': self.market_close if self.market_timezone is not None else None,
+                'holidays': self.holidays if self.market_timezone is not None else None,
+                'count_by': self.count_by}
+
+    def get_schema(self):
+        return SCHEMA.append(MENTIONS_FIELD) if self.count_by == 'mentions' else SCHEMA
+
+    def read_files(self, files):
+        '''Yield the rows of the given daily files one file at a time, reading only the columns we need
+        and pushing the date window down to the parquet reader.'''
+        start, end = self.get_window()
+        window = None
+        if start is not None:
+            window = ds.field('epoch_time') >= start
+        if end is not None:
+            window = ds.field('epoch_time') < end if window is None else window & (ds.field('epoch_time') < end)
+        schema = self.get_schema()
+        dataset = ds.dataset([join(self.path, f) for f in files], schema = schema, format = 'parquet')
+        for file, fragment in zip(files, dataset.get_fragments()):
+            yield file, fragment.to_table(schema = schema, filter = window).to_pandas()
+
+    def load_manifest(self):
+        try:
+            with open(join(self.cache_path, 'manifest.json')) as json_file:
+                manifest = json.load(json_file)
+        except (OSError, ValueError):
+            return []
+        if manifest.get('version') != CACHE_VERSION or manifest.get('settings') != self.get_settings():
+            return [] #cached rows only cover the window and day buckets they were built with
+        return manifest['files']
+
+    def save_manifest(self, entries):
+        #written next to the old one and swapped in, so a killed run leaves the old manifest rather than a truncated one
+        path = join(self.cache_path, 'manifest.json')
+        with open(path + '.tmp', 'w') as json_file:
+            json.dump({'version': CACHE_VERSION, 'settings': self.get_settings(), 'files': entries}, json_file)
+        replace(path + '.tmp', path)
+
+    def load_files(self):
+        '''Return the deduplicated rows and the daily ticker counts contributed by each daily file.
+
+        Both are cached per file and keyed by its name, modification time and size. As the deduplication
+        depends on the files read before, the cache is used up to the first added or changed file and
+        everything from there on is parsed again.
+        '''
+        files = self.list_files()
+        cached = self.load_manifest() if self.use_cache else []
+        entries = []
         for file in files:
-            df = pd.read_parquet(self.path+file, engine='pyarrow')
-            df = df.drop(labels = 'text',axis = 1) # dropping biggest column to prevent memory overloading
-            li.append(df)
-        full_df = pd.concat(li)
-        #print(full_df.dtypes)
+            file_stat = stat(join(self.path, file))
+            entries.append({'name': file, 'mtime': file_stat.st_mtime_ns, 'size': file_stat.st_size})
+        valid = 0
+        signature = lambda entry: (entry['name'], entry['mtime'], entry['size'])
+        while valid < min(len(entries), len(cached)) and signature(entries[valid]) == signature(cached[valid]):
+            entries[valid] = cached[valid] #keeps the duplicate counts of the cached file
+            valid += 1
 
+        rows, counts = [], []
+        for file in files[:valid]:
+            rows.append(pd.read_parquet(join(self.cache_path, 'rows_' + file), engine='pyarrow'))
+            counts.append(pd.read_parquet(join(self.cache_path, 'counts_' + file), engine='pyarrow'))
+        #ids seen so far, kept as sorted int64 arrays rather than sets of strings
+        cached_rows = pd.concat(rows) if rows else pd.DataFrame(columns = ['post_id', 'comment_id', 'text_type'])
+        seen = {'post': np.unique(encode_ids(cached_rows.loc[cached_rows['text_type'] == 'post', 'post_id'])),
+                'comment': np.unique(encode_ids(cached_rows.loc[cached_rows['text_type'] == 'comment', 'comment_id']))}
 
-        full_df = full_df.fillna('') #change NaNs to empty string
+        if self.use_cache:
+            makedirs(self.cache_path, exist_ok = True)
+        self.untagged_rows = 0 #rows without mention counts, see mention_weights
+        for entry, (file, df) in zip(entries[valid:], self.read_files(files[valid:])):
+            df[['post_id', 'comment_id']] = df[['post_id', 'comment_id']].fillna('')
 
-        #drop comments that are duplicates
-        full_df_comments = full_df.loc[full_df['text_type'] == 'comment']
-        full_df_comments = full_df_comments.drop_duplicates(subset = ['comment_id'])
-        #drop posts that are duplicates
-        full_df_posts = full_df.loc[full_df['text_type'] == 'post']
-        full_df_posts = full_df_posts.drop_duplicates(subset = ['post_id'])
-        #concat back together
-        full_df = pd.concat([full_df_posts,full_df_comments])
+            #drop comments and posts that are duplicates, also of the ones scraped on an earlier day
+            keep = np.zeros(len(df), dtype = bool)
+            for text_type, id_column in (('post', 'post_id'), ('comment', 'comment_id')):
+                positions = np.flatnonzero((df['text_type'] == text_type).to_numpy())
+                ids = encode_ids(df[id_column].to_numpy()[positions])
+                new = np.zeros(len(ids), dtype = bool)
+                new[np.unique(ids, return_index = True)[1]] = True #first occurrence within the file
+                new &= ~np.isin(ids, seen[text_type])
+                keep[positions[new]] = True
+                seen[text_type] = np.union1d(seen[text_type], ids[new])
+                entry['duplicate_' + text_type + 's'] = int(len(ids) - new.sum())
+            df = df.loc[keep].reset_index(drop = True)
 
-        #create a "Date" column from utc
-        full_df['date'] = full_df['epoch_time'].apply(lambda x: datetime.utcfromtimestamp(x))
+            #create a "Date" column from utc
+            df['date'] = bucket_days(df['epoch_time'], self.market_timezone, self.market_close, self.holidays)
+            if self.market_timezone is not None:
+                in_window = pd.Series(True, index = df.index)
+                if self.start_date is not None:
+                    in_window &= df['date'] >= pd.Timestamp(self.start_date)
+                if self.end_date is not None:
+                    in_window &= df['date'] <= pd.Timestamp(self.end_date)
+                df = df.loc[in_window].reset_index(drop = True)
+            file_counts = self.count_mentions(df)
+            rows.append(df)
+            counts.append(file_counts)
+            if self.use_cache:
+                df.to_parquet(join(self.cache_path, 'rows_' + file), engine='pyarrow')
+                file_counts.to_parquet(join(self.cache_path, 'counts_' + file), engine='pyarrow')
+        if self.use_cache:
+            self.save_manifest(entries)
+        print(f'{valid} daily files loaded from cache, {len(files) - valid} parsed.')
+        if self.untagged_rows:
+            print(f'{self.untagged_rows} rows have no mention counts and count once per ticker, retag them with retag_archive.py.')
+
+        #how many posts and comments of each day were already scraped before, a measure of the scrape overlap
+        self.duplicates = pd.DataFrame({'posts': [e.get('duplicate_posts', 0) for e in entries],
+                                        'comments': [e.get('duplicate_comments', 0) for e in entries]},
+                                       index = pd.Index([file_date(f) for f in files], name = 'scraped'))
+        return rows, counts
+
+    def create_df(self):
+        rows, self.daily_counts = self.load_files()
+        full_df = pd.concat(rows)
+        #print(full_df.dtypes)
 
-        #prepare the final dataframe ticker_matrix
-        full_df['date'] = pd.to_datetime(full_df['date']).dt.date
-        #March 17th seems to be a reasonable lower bound for our dataset
-        full_df = full_df.loc[full_df['date'] >= pd.to_datetime('2021-03-17').date()]
+        full_df = full_df.fillna('') #change NaNs to empty string
 
         return full_df
 
+    def mention_weights(self, df):
+        '''Return one row per ticker in each post or comment, with the number of times it is mentioned there.
+
+        Rows tagged before mention counts were stored (null mentions) count once per ticker, run
+        retag_archive.py to count their mentions as well.'''
+        tagged = df['mentions'].notna()
+        self.untagged_rows += int((~tagged & df['tickers'].notna()).sum())
+        mentions = df.loc[tagged, ['date', 'mentions']].explode('mentions').dropna(subset = ['mentions'])
+        weights = pd.DataFrame({'date': mentions['date'],
+                                'tickers': [mention['ticker'] for mention in mentions['mentions']],
+                                'weight': [mention['count'] for mention in mentions['mentions']]})
+        untagged = df.loc[~tagged, ['date', 'tickers']].explode('tickers').dropna(subset = ['tickers'])
+        return pd.concat([weights, untagged.assign(weight = 1)])
+
+    def count_mentions(self, df):
+        '''Return the number of mentions of each ticker on each day in the given rows, one row per
+        (date, ticker) pair. Depending on count_by, a post or comment adds one for each ticker it
+        mentions or the number of times it mentions it.'''
+        #one row per mentioned ticker, rows without any mention drop out
+        if self.count_by == 'mentions':
+            mentions = self.mention_weights(df)
+        else:
+            mentions = df[['date', 'tickers']].explode('tickers').dropna(subset = ['tickers'])
+        if mentions.empty:
+            return pd.DataFrame({'date': pd.to_datetime([]), 'ticker': pd.Series([], dtype='str'), 'mentions': pd.Series([], dtype='float64')})
+
+        #encode both dimensions and count the date x ticker codes in one go
+        date_codes, dates = pd.factorize(mentions['date'], sort = True)
+        ticker_codes, tickers = pd.factorize(mentions['tickers'], sort = True)
+        weights = mentions['weight'].to_numpy(dtype = 'float64') if 'weight' in mentions else None
+        counts = np.bincount(date_codes * len(tickers) + ticker_codes, weights = weights, minlength = len(dates) * len(tickers))
+
+        #stored in a long format, most tickers are not mentioned on most days
+        nonzero = np.flatnonzero(counts)
+        return pd.DataFrame({'date': pd.to_datetime(dates[nonzero // len(tickers)]),
+                             'ticker': tickers[nonzero % len(tickers)],
+                             'mentions': counts[nonzero].astype('float64')})
 
     def create_ticker_matrix(self):
         date_index = self.full_df['date'].unique()
         date_index.sort()
-        ticker_matrix = pd.DataFrame(index = date_index)
-        ticker_matrix.index = pd.to_datetime(ticker_matrix.index)
-
-        #with values being the number of mentions for each day
-        for i in range(len(self.full_df)):
-            row = self.full_df.iloc[i]
-            row_date = row['date']
-            if row['tickers'] != []:
-                for ticker in row['tickers']: 
-                    #rowIndex = ticker_matrix.index[row['date']]
-                    if(ticker not in ticker_matrix.columns): #column already crated
-                        ticker_matrix[ticker] = pd.Series(dtype='int64')
-        ticker_matrix = ticker_matrix.fillna(0)
-        #now we create matrix with rows as days and columns as ticker mentions,
-        #with values being the number of mentions for each day
-        for i in range(len(self.full_df)):
-            row = self.full_df.iloc[i]
-            row_date = row['date']
-            if row['tickers'] != []:
-                for ticker in row['tickers']: 
-                    ticker_matrix.loc[[row_date],[ticker]] += 1 #add mention
+        date_index = pd.to_datetime(date_index)
+
+        #merge the daily counts of all files, keeping the days of our dataset only
+        counts = pd.concat(self.daily_counts)
+        counts = counts.loc[counts['date'].isin(date_index)]
+        counts = counts.groupby(['ticker', 'date'])['mentions'].sum().astype('int64')
 
         #we do not want to work with tickers mentioned only once as that is too small of a dataset, so we leave these out
-        above_one = ticker_matrix.apply(sum,axis = 0)>1
-        trimmed_df = ticker_matrix[above_one.index[above_one]]#['NDAQ']
+        totals = counts.groupby(level = 'ticker').sum()
+        counts = counts.loc[totals.index[totals >= self.min_mentions]]
+
+        #matrix with rows as days and columns as ticker mentions, most tickers are only mentioned on a handful of days,
+        #so each column is kept as a sparse array and the full dense matrix is never created
+        tickers = counts.index.get_level_values('ticker')
+        positions = date_index.get_indexer(counts.index.get_level_values('date'))
+        values = counts.to_numpy()
+        starts = np.flatnonzero(np.r_[True, tickers[1:] != tickers[:-1]]) if len(counts) else np.array([], dtype = 'int64')
+        ends = np.r_[starts[1:], len(counts)]
+        columns = {}
+        for start, end in zip(starts, ends):
+            column = np.zeros(len(date_index), dtype = 'int64')
+            column[positions[start:end]] = values[start:end]
+            columns[tickers[start]] = pd.arrays.SparseArray(column, fill_value = 0)
+        sparse_matrix = pd.DataFrame(columns, index = date_index)
+
+        return sparse_matrix
 
-        return trimmed_df
-    
     def get_info(self):
         #summary statistics
         print(self.full_df.shape)
@@ -96,4 +348,7 @@ class Ticker_Matrix:
         print(self.ticker_matrix.apply(max).sort_values(ascending = False).head())
         print()
         print("Top days:")
-        print(self.ticker_matrix.apply(sum,axis = 1).sort_values(ascending = False).head())
\ No newline at end of file
+        print(self.ticker_matrix.apply(sum,axis = 1).sort_values(ascending = False).head())
+        print()
+        print("Duplicates dropped (already scraped on an earlier day):")
+        print(self.duplicates.sum())
\ No newline at end of file
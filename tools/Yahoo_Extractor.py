@@ -1,30 +1,117 @@
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
+import os
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 import datetime
 import pandas as pd
 import numpy as np
 from io import StringIO
+import argparse
+import tools.Stock_Dictionary as stock_dictionary
 
 #path = "C:\\Users\\hso20\\Python\\Project\\YahooData\\"
 
+YAHOO_URL = 'https://query1.finance.yahoo.com/v7/finance/download/'
+CACHE_DIR = os.path.join('data', 'yahoo_cache')
+DATA_PATH = os.path.join('data', 'yahoo_data.csv')
+DATE_FORMAT = "%b %d, %Y"
+
+
+def row_periods(rows, period1, period2):
+    '''Return which rows of a Yahoo csv are dated from period1 up to period2 (epoch seconds, period2 excluded).'''
+    days = pd.to_datetime(rows['Date']).dt.tz_localize('UTC')
+
+    return (days >= pd.Timestamp(period1, unit = 's', tz = 'UTC')) & (days < pd.Timestamp(period2, unit = 's', tz = 'UTC'))
+
+
+class Adaptive_Rate_Limiter:
+    '''Space out requests shared by several threads and adapt the spacing to how the server responds.
+    
+    :usage:
+        limiter = Adaptive_Rate_Limiter(min_interval = 0.1)
+        limiter.acquire()
+        limiter.success()   #or limiter.throttled() after a 429 or 5xx response
+    
+    :note:
+    - The interval between two requests doubles whenever the server pushes back (up to max_interval)
+        and shrinks by 10 % after every successful request (down to min_interval), so the download
+        runs as fast as Yahoo allows without a fixed sleep after each ticker.
+    '''
+    def __init__(self, min_interval = 0.1, max_interval = 30):
+        '''The constructor for the Adaptive_Rate_Limiter class.
+        
+        :args:
+        - min_interval (float): Shortest time in seconds between two requests.
+        - max_interval (float): Longest time in seconds between two requests.
+        '''
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Block until the next request may be sent.'''
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0, self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def success(self):
+        '''Shorten the interval after a successful request.'''
+        with self.lock:
+            self.interval = max(self.min_interval, self.interval * 0.9)
+
+    def throttled(self, retry_after = None):
+        '''Lengthen the interval after the server refused a request, honouring its Retry-After if given.'''
+        with self.lock:
+            self.interval = min(self.max_interval, max(self.interval * 2, self.min_interval))
+            if retry_after is not None:
+                self.next_time = max(self.next_time, time.monotonic() + min(retry_after, self.max_interval))
+
+
 class Yahoo_Extractor:
     '''Scrape stock data from Yahoo finance and return this data as a pandas data frame or an excel file
     
     :usage:
         Y = Yahoo_Extractor('2020-05-15','2021-05-15')  
         Y.create_excel(path)
+        Y.update_data()                  #downloads only the days missing in data/yahoo_data.csv
     '''
-    def __init__(self, start_date, end_date):
+    def __init__(self, start_date, end_date, base_url = YAHOO_URL, cache_dir = CACHE_DIR, max_workers = 8,
+                 rate_limiter = None, retries = 4, timeout = 30, interval = '1d'):
         '''The constructor for the Yahoo_Extractor class.
         
         :args:
-        - start_date (datetime.object): The date from which the stock volume traded should be extracted.
-        - end_date (datetime.object): The date until which the stock volume traded should be extracted.
+        - start_date (str): The date from which the stock volume traded should be extracted, e.g. '2021-03-18'.
+        - end_date (str): The date until which the stock volume traded should be extracted (included).
+        - base_url (str): Url the ticker is appended to, e.g. a local server serving csv files in tests.
+        - cache_dir (str): Folder keeping the downloaded rows of each ticker, None disables the cache.
+        - max_workers (int): Number of tickers downloaded at the same time.
+        - rate_limiter (Adaptive_Rate_Limiter): Spacing of the requests, a default one is created if not given.
+        - retries (int): How many times a throttled or failed request is repeated before the ticker is skipped.
+        - timeout (float): Seconds to wait for a response.
+        - interval (str): Spacing of the rows Yahoo returns, '1d' for daily volumes.
         '''
         self.start_date = start_date
         self.end_date = end_date
+        self.base_url = base_url
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter if rate_limiter is not None else Adaptive_Rate_Limiter()
+        self.retries = retries
+        self.timeout = timeout
+        self.interval = interval
+        self.session = requests.Session()          #keeps the connections to Yahoo open between tickers
+        adapter = HTTPAdapter(pool_connections = max_workers, pool_maxsize = max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     def get_dates(self):
         '''Return a list of dates for the range inhereted from the class constructor.
@@ -59,62 +146,170 @@ class Yahoo_Extractor:
             seem redundant having a method to get all 500 S&P stocks. However, we feel like this may be used
             to compare various datasets with the S&P list as a benchmark, so we include the method here.
         '''
-        tickers = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
-        acro_list = tickers[0]['Symbol'].tolist()             #creating a list of tickers
-        acro_list = [a.replace('.', '-') for a in acro_list]
+        acro_list = stock_dictionary.get_acro_list()          #cached with the stock dictionary, see Stock_Dictionary.py
     
         return acro_list    
 
-    def get_data(self, acro):
+    def cache_path(self, acro, period1, period2):
+        '''Return the file caching the rows of a ticker from period1 up to period2 (epoch seconds, period2 excluded).'''
+        return os.path.join(self.cache_dir, '_'.join([acro, self.interval, str(period1), str(period2)]) + '.csv')
+
+    def cached_files(self, acro):
+        '''Return (period1, period2, path) of every cache file of a ticker and the interval, widest range last.'''
+        prefix = acro + '_' + self.interval + '_'
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return []
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not (name.startswith(prefix) and name.endswith('.csv')):
+                continue
+            periods = name[len(prefix):-len('.csv')].split('_')
+            if len(periods) == 2 and all(period.isdigit() for period in periods):
+                files.append((int(periods[0]), int(periods[1]), os.path.join(self.cache_dir, name)))
+
+        return sorted(files, key = lambda f: f[1] - f[0])
+
+    def read_cache(self, acro):
+        '''Return the cached rows of a ticker and the range (period1, period2) they cover, (None, None) if there are none.'''
+        files = self.cached_files(acro)
+        if not files:
+            return None, None
+        period1, period2, path = files[-1]
+
+        return pd.read_csv(path, encoding = 'utf-8'), (period1, period2)
+
+    def write_cache(self, acro, rows, period1, period2):
+        '''Replace the cache files of a ticker by one file with its rows from period1 up to period2.'''
+        superseded = self.cached_files(acro)
+        path = self.cache_path(acro, period1, period2)
+        os.makedirs(self.cache_dir, exist_ok = True)
+        rows[row_periods(rows, period1, period2)].to_csv(path + '.tmp', index = False, encoding = 'utf-8')
+        os.replace(path + '.tmp', path)           #a run killed while writing leaves no half cached file
+        for begin, finish, old in superseded:
+            if old != path:
+                os.remove(old)
+
+    def download(self, acro, params):
+        '''Download the csv of a ticker, retrying with a longer interval when the server is throttling.
+        
+        :args:
+        - acro (str): A ticker representing the stock.
+        - params (dict): Query of the request.
+        
+        :returns:
+        - text (str): The csv returned by the server, None if it could not be downloaded.
+        '''
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                r = self.session.get(self.base_url + acro, params = params, timeout = self.timeout)
+            except requests.RequestException:
+                self.rate_limiter.throttled()
+                continue
+            if r.status_code == 429 or r.status_code >= 500:
+                retry_after = r.headers.get('Retry-After')
+                self.rate_limiter.throttled(float(retry_after) if retry_after and retry_after.isdigit() else None)
+                continue
+            if r.status_code != 200:              #e.g. 404 for a delisted ticker, asking again will not help
+                return None
+            self.rate_limiter.success()
+            return r.text
+
+        return None
+
+    def get_data(self, acro, start_date = None, end_date = None):
         '''Specify a ticker of a stock and return a data frame for said stock containing information
             about volume traded.
             
         :args:
         - acro (str): A ticker representing the stock for which the information should be extracted.
+        - start_date (str): First day to download, start_date of the constructor if not specified.
+        - end_date (str): Last day to download, end_date of the constructor if not specified.
         
         :usage:
             self.get_data('AAPL')
+            self.get_data('AAPL', '2021-07-06', '2021-07-07')
             
         :returns:
-        - stocksDF (pd.DataFrame): A data frame containing information about volume traded for the desired stock.
+        - stocksDF (pd.DataFrame): A data frame containing information about volume traded for the desired stock,
+            None if the stock could not be downloaded or the response has no Date and Volume columns.
+
+        :note:
+        - The rows of each ticker are cached in one file per interval covering one range of days. Only the days before
+            and after that range are downloaded and merged into it, the file of the old range is removed.
+            Days from today on are downloaded every time, their volumes are not final yet.
         '''
-        link = 'https://query1.finance.yahoo.com/v7/finance/download/' + acro + '?modules=balanceSheetHistory&period1=1616014800&period2=1625688000'
-        r = requests.get(link)
-        r_text = StringIO(r.text)
-        temp = pd.read_csv(r_text)[['Date', 'Volume']].set_index('Date')
+        start = pd.Timestamp(start_date or self.start_date, tz = 'UTC')
+        end = pd.Timestamp(end_date or self.end_date, tz = 'UTC') + pd.Timedelta(days = 1) #period2 is exclusive
+        period1, period2 = int(start.timestamp()), int(end.timestamp())
+        rows, covered = self.read_cache(acro) if self.cache_dir is not None else (None, None)
+        if covered is None:
+            pieces = [(period1, period2)]
+            covered = (period1, period1)
+        else:                                     #only the days around the cached ones, the cache stays one range
+            pieces = [(min(period1, covered[0]), covered[0]), (covered[1], max(period2, covered[1]))]
+            pieces = [(begin, finish) for begin, finish in pieces if begin < finish]
+        frames = [] if rows is None else [rows]
+        for begin, finish in pieces:
+            params = {'modules': 'balanceSheetHistory', 'period1': begin, 'period2': finish, 'interval': self.interval}
+            text = self.download(acro, params)
+            if text is None:
+                return None
+            try:
+                piece = pd.read_csv(StringIO(text))
+            except (pd.errors.ParserError, pd.errors.EmptyDataError):
+                piece = None
+            if piece is None or not {'Date', 'Volume'}.issubset(piece.columns): #e.g. a consent or error page sent with 200
+                print('No volumes in the response for', acro)
+                return None
+            frames.append(piece[row_periods(piece, begin, finish)])
+        rows = pd.concat(frames).drop_duplicates('Date', keep = 'last').sort_values('Date')
+        over = int(pd.Timestamp.now(tz = 'UTC').normalize().timestamp()) #volumes of today will still change
+        first, last = min(period1, covered[0]), min(max(period2, covered[1]), over)
+        if self.cache_dir is not None and pieces and first < last:
+            self.write_cache(acro, rows, first, last)
+        rows = rows[row_periods(rows, period1, period2)]
+        temp = rows[['Date', 'Volume']].set_index('Date')
         temp = temp.sort_index(ascending = False)
-        temp.index = pd.to_datetime(temp.index).strftime("%b %d, %Y")
+        temp.index = pd.to_datetime(temp.index).strftime(DATE_FORMAT)
         stocksDF = temp.rename(columns = {'Volume' : acro})
 
         return stocksDF
     
-    def join_data(self, acro = None):
+    def join_data(self, acro = None, ranges = None):
         '''Specify the list of desired tickers and return a data frame containing information about
             stock volume traded for stocks represented by said tickers. If acro is not specified,
             get the acro list from the S&P 500.
             
         :args:
         - acro (list): List of tickers to be used in the data frame.
+        - ranges (dict): Optional (start_date, end_date) per ticker, tickers missing in it use the dates of the constructor.
         
         :usage:
             self.join_data()
+            self.join_data(['AAPL', 'MSFT'], {'AAPL': ('2021-07-06', '2021-07-07')})
             
         :returns:
         - data (pd.DataFrame): A data frame containing stock volume traded information for the desired stocks.
+        
+        :note:
+        - The tickers are downloaded by max_workers threads sharing one session and one rate limiter,
+            tickers which could not be downloaded are left out and listed at the end.
         '''
         if acro == None:
             acro = self.get_acro_list()
+        ranges = ranges or {}
             
-        data = pd.DataFrame()
-        
-        for a in acro:
-            start = time.time()
-            stocksDF = self.get_data(a)
-            time.sleep(1)
-            data = pd.concat([data, stocksDF], axis = 1, copy = False)
-            end = time.time()
-            print('Ellapsed time for stock', a)
-            print(end-start)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            frames = list(executor.map(lambda a: self.get_data(a, *ranges.get(a, (None, None))), acro))
+        missing = [a for a, stocksDF in zip(acro, frames) if stocksDF is None]
+        frames = [stocksDF for stocksDF in frames if stocksDF is not None]
+        data = pd.concat(frames, axis = 1, copy = False) if frames else pd.DataFrame()
+        print('Ellapsed time for', len(frames), 'stocks')
+        print(time.time() - start)
+        if missing:
+            print('Could not download', len(missing), 'stocks:', ', '.join(missing))
             
         data = data.dropna(axis = 0, how = 'all')
 
@@ -144,4 +339,99 @@ class Yahoo_Extractor:
         data.to_csv(path_or_buf=s.join(nameVars),sep = ',', index=True, encoding='utf-8-sig')
         
         return None
+    
+    def missing_ranges(self, data, acro):
+        '''Return the days each ticker still needs to cover the range of the constructor.
+        
+        :args:
+        - data (pd.DataFrame): Volumes downloaded before, dates (datetime) in the index and tickers in the columns.
+        - acro (list): Tickers which should be in the data.
+        
+        :usage:
+            self.missing_ranges(data, acro)
+        
+        :returns:
+        - ranges (dict): (start_date, end_date) for every ticker with missing trading days.
+        
+        :note:
+        - Only the days after the last stored volume and, if start_date is earlier than the stored data, the days before
+            it are missing. Gaps in between are holidays, a ticker starting later than the others was listed later.
+            A last stored day from yesterday or today is downloaded again, it may have been stored before the market closed.
+        '''
+        start = pd.Timestamp(self.start_date)
+        end = pd.Timestamp(self.end_date)
+        recent = pd.Timestamp(date.today()) - pd.Timedelta(days = 1)
+        stored_from = data.index.min() if len(data) else end
+        ranges = {}
+        for a in acro:
+            known = data[a].dropna().index if a in data.columns else pd.DatetimeIndex([])
+            if len(known) == 0:
+                ranges[a] = (start, end)
+                continue
+            first, last = known.min(), known.max()
+            tail = last if last >= recent else last + pd.Timedelta(days = 1)
+            missing_head = len(pd.bdate_range(start, min(first, stored_from) - pd.Timedelta(days = 1))) > 0
+            missing_tail = len(pd.bdate_range(tail, end)) > 0
+            if missing_head and missing_tail:
+                ranges[a] = (start, end)
+            elif missing_head:
+                ranges[a] = (start, first - pd.Timedelta(days = 1))
+            elif missing_tail:
+                ranges[a] = (tail, end)
+            
+        return {a: (begin.strftime('%Y-%m-%d'), finish.strftime('%Y-%m-%d')) for a, (begin, finish) in ranges.items()}
+    
+    def update_data(self, path = DATA_PATH, acro = None):
+        '''Bring a stored volume file up to the range of the constructor by downloading only the missing days.
+        
+        :args:
+        - path (str): The csv (or parquet) file to update, created if it does not exist.
+        - acro (list): Tickers to keep up to date, the S&P 500 if not specified. Stored tickers not in the list are kept as they are.
+        
+        :usage:
+            Y = Yahoo_Extractor('2021-03-18', date.today().isoformat())
+            Y.update_data()
+        
+        :returns:
+        - data (pd.DataFrame): The updated volumes, also written back to path.
+        '''
+        if acro == None:
+            acro = self.get_acro_list()
+        if not os.path.exists(path):
+            data = pd.DataFrame()
+        elif path.endswith('.parquet'):
+            data = pd.read_parquet(path)
+        else:
+            data = pd.read_csv(path, index_col = [0], encoding = 'utf-8-sig')
+        data.index = pd.to_datetime(data.index, format = DATE_FORMAT) if len(data) else pd.DatetimeIndex([])
+        
+        ranges = self.missing_ranges(data, acro)
+        print('Updating', len(ranges), 'of', len(acro), 'stocks')
+        new = self.join_data(list(ranges), ranges) if ranges else pd.DataFrame()
+        if len(new):
+            new.index = pd.to_datetime(new.index, format = DATE_FORMAT)
+            columns = list(data.columns) + [a for a in new.columns if a not in data.columns]
+            data = new.combine_first(data)[columns]       #downloaded values win over stored ones of the same day
+        data = data.sort_index(ascending = False)
+        data.index.name = 'Date'
+        
+        stored = data.round().astype('Int64')             #volumes stay integers in the file, missing ones empty
+        stored.index = stored.index.strftime(DATE_FORMAT)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        if path.endswith('.parquet'):
+            stored.to_parquet(path + '.tmp')
+        else:
+            stored.to_csv(path_or_buf = path + '.tmp', sep = ',', index = True, encoding = 'utf-8-sig')
+        os.replace(path + '.tmp', path)                   #an interrupted update leaves the old file intact
+        
+        return data
+
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Download the missing days of the Yahoo volume data.')
+    parser.add_argument('--path', default = DATA_PATH)
+    parser.add_argument('--start', default = '2021-03-17', help = 'first day the data should cover')
+    parser.add_argument('--end', default = date.today().isoformat(), help = 'last day the data should cover')
+    args = parser.parse_args()
+    data = Yahoo_Extractor(args.start, args.end).update_data(args.path)
+    print("Stored", data.shape[1], "stocks over", data.shape[0], "days in", args.path)
@@ -1,19 +1,196 @@
 import praw
+import prawcore
+from praw.endpoints import API_PATH
+import os
 import re
 import time
+import threading
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
 import pandas as pd
+import pyarrow as pa
+
+#columns of the extracted data and their types
+COLUMNS = {'post_id': 'object',
+           'comment_id': 'object',
+           'subreddit': 'object',
+           'text_type': 'object',
+           'epoch_time': 'int64',
+           'text': 'object',
+           'tickers': 'object',
+           'mentions': 'object'}
+
+MORE_CHILDREN = 100 #ids per /api/morechildren request, the most reddit accepts
+
+#every ticker mentioned in a text with the number of mentions and the character offset of each
+MENTIONS_TYPE = pa.list_(pa.struct([('ticker', pa.string()),
+                                    ('count', pa.int32()),
+                                    ('offsets', pa.list_(pa.int32()))]))
+
+#the same columns as stored in parquet
+ARROW_SCHEMA = pa.schema([('post_id', pa.string()),
+                          ('comment_id', pa.string()),
+                          ('subreddit', pa.string()),
+                          ('text_type', pa.string()),
+                          ('epoch_time', pa.int64()),
+                          ('text', pa.string()),
+                          ('tickers', pa.list_(pa.string())),
+                          ('mentions', MENTIONS_TYPE)])
+
+#shared request budget of all threads, reddit allows an oauth client 600 requests every 10 minutes
+#up to burst requests are sent at once, the rest of the budget refills evenly over the period,
+#so no window of period seconds holds more than requests requests, not even the first one
+class Rate_Limiter:
+    def __init__(self, requests = 600, period = 600, burst = 60):
+        self.capacity = min(burst, requests)
+        self.rate = (requests - self.capacity) / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    def acquire(self): #blocks until the next request fits into the budget
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+#every http request praw makes goes through here, so all threads stay inside the same budget
+class Rate_Limited_Requestor(prawcore.Requestor):
+    def __init__(self, *args, rate_limiter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+    def request(self, *args, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return super().request(*args, **kwargs)
+
+#requests and time all threads may spend on expanding MoreComments, None means no limit of that kind
+class Comment_Budget:
+    def __init__(self, seconds = None, requests = None):
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.remaining = requests
+        self.spent = 0
+        self.lock = threading.Lock()
+    def spend(self): #takes one request from the budget, False once it is used up
+        with self.lock:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                return False
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return False
+                self.remaining -= 1
+            self.spent += 1
+            return True
+
+#high-water mark of previous runs: per subreddit the newest created_utc and, for recent posts,
+#their comment count and the ids of the comments already collected
+#kept in a local json file or, for paths starting with s3://, in an s3 object
+class Scrape_State:
+    def __init__(self, path, keep_days = 7):
+        self.path = path
+        self.keep_seconds = keep_days * 86400 #posts older than this are forgotten and never fetched again
+        self.lock = threading.Lock()
+        self.subreddits = self.load()
+
+    def splitS3(self):
+        bucket, key = self.path[len('s3://'):].split('/', 1)
+        return bucket, key
+
+    def load(self):
+        if self.path.startswith('s3://'):
+            import boto3 #only available where the state is kept in s3, e.g. on lambda
+            bucket, key = self.splitS3()
+            s3 = boto3.client('s3')
+            try:
+                body = s3.get_object(Bucket = bucket, Key = key)['Body'].read()
+            except s3.exceptions.NoSuchKey: #first run
+                return {}
+            return json.loads(body)
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as json_file:
+            return json.load(json_file)
+
+    def save(self): #call once the scraped data is stored, so a failed run is fetched again
+        with self.lock:
+            for state in self.subreddits.values():
+                horizon = state['last_created'] - self.keep_seconds
+                state['posts'] = {post_id: post for post_id, post in state['posts'].items() if post['created'] >= horizon}
+            body = json.dumps(self.subreddits)
+        if self.path.startswith('s3://'):
+            import boto3
+            bucket, key = self.splitS3()
+            boto3.client('s3').put_object(Bucket = bucket, Key = key, Body = body.encode())
+        else:
+            with open(self.path + '.tmp', 'w') as json_file:
+                json_file.write(body)
+            os.replace(self.path + '.tmp', self.path)
+
+    def subreddit(self,name):
+        with self.lock:
+            return self.subreddits.setdefault(name, {'last_created': 0, 'posts': {}})
+
+    def status(self,post):
+        #'new' posts are fetched whole, 'active' ones got comments since the last run and only their new comments are kept,
+        #'done' ones are skipped without a request
+        state = self.subreddit(post.subreddit.display_name)
+        known = state['posts'].get(post.id)
+        if known is None:
+            if post.created_utc < state['last_created'] - self.keep_seconds: #collected before it was forgotten
+                return 'done'
+            return 'new'
+        return 'active' if post.num_comments > known['num_comments'] else 'done'
+
+    def seenComments(self,post):
+        known = self.subreddit(post.subreddit.display_name)['posts'].get(post.id)
+        return set(known['comments']) if known else set()
+
+    def update(self,post,commentIds):
+        state = self.subreddit(post.subreddit.display_name)
+        with self.lock:
+            known = state['posts'].setdefault(post.id, {'created': post.created_utc, 'comments': []})
+            known['num_comments'] = post.num_comments
+            known['comments'] = sorted(set(known['comments']).union(commentIds))
+            state['last_created'] = max(state['last_created'], post.created_utc)
 
 class Reddit_Extractor:
-    def __init__(self, credentials):
-        self.reddit =  praw.Reddit(
-            client_id = credentials['client_id'],
-            client_secret = credentials['client_secret'],
-            user_agent = credentials['user_agent'],
-            username = credentials['username'],
-            password = credentials['password'])
+    def __init__(self, credentials, max_workers = 8, rate_limiter = None, comment_limit = 5,
+                 comment_depth = 0, max_comments = None, comment_budget = None, state = None):
+        self.credentials = credentials
+        self.comment_limit = comment_limit #top level comments loaded per post
+        self.comment_depth = comment_depth #deepest reply level kept, 0 keeps only top level comments
+        self.max_comments = max_comments #comments kept per post, None keeps all that were loaded
+        self.comment_budget = comment_budget #Comment_Budget for expanding MoreComments, None skips them
+        self.max_workers = max_workers #parallel requests, 1 fetches everything one after another
+        self.rate_limiter = rate_limiter or Rate_Limiter()
+        self.local = threading.local()
+        self.reddit = self.connect()
+        self.local.reddit = self.reddit
+        self.state = state #Scrape_State of the previous runs, None fetches everything
+        self.timings = {} #seconds spent on each subreddit in the last joinData
+    def connect(self):
+        #oauth_url and reddit_url may point praw to another server, e.g. a local fake reddit api for testing
+        urls = {key: self.credentials[key] for key in ('oauth_url', 'reddit_url') if key in self.credentials}
+        return praw.Reddit(
+            client_id = self.credentials['client_id'],
+            client_secret = self.credentials['client_secret'],
+            user_agent = self.credentials['user_agent'],
+            username = self.credentials['username'],
+            password = self.credentials['password'],
+            requestor_class = Rate_Limited_Requestor,
+            requestor_kwargs = {'rate_limiter': self.rate_limiter},
+            **urls)
+    def getReddit(self): #praw is not thread safe, so every thread gets its own instance
+        if not hasattr(self.local, 'reddit'):
+            self.local.reddit = self.connect()
+        return self.local.reddit
     def subredditData(self,subreddit,limit = 10):
-        postList = self.reddit.subreddit(subreddit).hot(limit=limit)
+        postList = self.getReddit().subreddit(subreddit).hot(limit=limit)
         return postList     
         
     def showcasePrint(self,postList):
@@ -28,65 +205,448 @@ class Reddit_Extractor:
                 print(top_level_comment.created_utc)
                 i+=1'''    
             
-    def subredditDF(self,postList):
-        df = pd.DataFrame({'post_id': pd.Series([], dtype='str'),
-                        'comment_id': pd.Series([], dtype='str'),
-                        'subreddit': pd.Series([], dtype='str'),
-                        'text_type': pd.Series([], dtype='str'),
-                        'epoch_time': pd.Series([], dtype='int'),
-                        'text': pd.Series([], dtype='str'),
-                        'tickers': pd.Series([], dtype='str')})  
+    def loadComments(self,post,sort = 'best'):
+        submission = self.getReddit().submission(id=post.id)
+        submission.comment_sort = sort
+        submission.comment_limit = self.comment_limit
+        return self.walkComments(submission, submission.comments) #fetched here, in the calling thread
+
+    def walkComments(self,submission,forest):
+        #flat list of the comments down to comment_depth, shallower levels first, at most max_comments,
+        #MoreComments are expanded largest first while the shared comment_budget lasts, one request per batch
+        comments = []
+        depths = {}
+        expand = []
+        queue = deque((item, 0) for item in forest)
+        while self.max_comments is None or len(comments) < self.max_comments:
+            if queue:
+                item, depth = queue.popleft()
+                if depth > self.comment_depth:
+                    continue
+                if isinstance(item, praw.models.MoreComments):
+                    if self.comment_budget is not None:
+                        heapq.heappush(expand, (-item.count, len(depths), id(item), list(item.children), depth, item))
+                    continue
+                if item.id in depths:
+                    continue
+                depths[item.id] = depth
+                comments.append(item)
+                if depth < self.comment_depth:
+                    queue.extend((reply, depth + 1) for reply in item.replies)
+            elif expand and self.comment_budget.spend():
+                for item, depth in self.expandMore(submission, expand):
+                    parent = item.parent_id.split('_', 1)[1]
+                    queue.append((item, depths[parent] + 1 if parent in depths else depth))
+            else:
+                break
+        return comments
+
+    def expandMore(self,submission,expand):
+        #one request: a "continue this thread" stub on its own, otherwise the child ids of the largest
+        #pending MoreComments together in one /api/morechildren call, a stub that does not fit is split
+        if not expand[0][3]:
+            more, depth = heapq.heappop(expand)[4:]
+            more.submission = submission
+            return [(item, depth) for item in more.comments()] #a whole subtree, fetched from its parent
+        children = {}
+        while expand and expand[0][3] and len(children) < MORE_CHILDREN:
+            count, order, key, ids, depth, more = heapq.heappop(expand)
+            room = MORE_CHILDREN - len(children)
+            children.update((child, depth) for child in ids[:room])
+            if ids[room:]:
+                heapq.heappush(expand, (-len(ids[room:]), order, key, ids[room:], depth, more))
+        data = {'children': ','.join(children),
+                'link_id': submission.fullname,
+                'sort': submission.comment_sort}
+        items = submission._reddit.post(API_PATH['morechildren'], data=data) #flat list of the children and replies
+        found = []
+        for item in items:
+            item.submission = submission
+            parent = item.parent_id.split('_', 1)[1]
+            depth = children[parent] + 1 if parent in children else children.get(item.id, min(children.values()))
+            children.setdefault(item.id, depth) #replies come after their parents
+            found.append((item, depth))
+        return found
+
+    def newColumns(self): #one list per column, rows are added value by value and the frame is built once
+        return {column: [] for column in COLUMNS}
+
+    def record(self,post_id,comment_id,subreddit,text_type,epoch_time,text):
+        return {'post_id': post_id,
+                'comment_id': comment_id,
+                'subreddit': subreddit,
+                'text_type': text_type,
+                'epoch_time': int(epoch_time),
+                'text': text,
+                'tickers': None,
+                'mentions': None}
+
+    def postRecords(self,post,comments):
+        #post extraction
+        yield self.record(post.id, None, post.subreddit.display_name, 'post', post.created_utc, post.title+post.selftext)
+        #comments extraction
+        for comment in comments:
+            if isinstance(comment, praw.models.MoreComments):
+                continue
+            yield self.record(post.id, comment.id, comment.subreddit.display_name, 'comment',
+                              comment.created_utc, comment.body)
+
+    def postStatus(self,post):
+        return 'new' if self.state is None else self.state.status(post)
+
+    def statusComments(self,post,status): #only the newest comments can be missing from a thread seen before
+        return self.loadComments(post, 'best' if status == 'new' else 'new')
+
+    def freshRecords(self,post,status,comments): #the records not collected by a previous run
+        if self.state is None:
+            yield from self.postRecords(post, comments)
+            return
+        seen = self.state.seenComments(post)
+        for record in self.postRecords(post, comments):
+            if record['comment_id'] is None and status != 'new' or record['comment_id'] in seen:
+                continue
+            yield record
+        self.state.update(post, [comment.id for comment in comments if not isinstance(comment, praw.models.MoreComments)])
+
+    def addRow(self,columns,record):
+        for column in columns:
+            columns[column].append(record[column])
+
+    def buildFrame(self,columns):
+        return pd.DataFrame({column: pd.Series(values, dtype=COLUMNS[column]) for column, values in columns.items()})
+
+    def subredditRows(self,postList,columns,pool = None):
+        postList = list(postList)
+        ownPool = pool is None
+        if ownPool:
+            pool = ThreadPoolExecutor(max_workers = self.max_workers)
+        #comment trees are loaded in parallel, the most commented posts first so they get the expansion budget
+        #posts unchanged since the last run are skipped without a request
+        futures = {}
+        for post in sorted(postList, key = lambda post: -(getattr(post, 'num_comments', 0) or 0)):
+            status = self.postStatus(post)
+            if status != 'done':
+                futures[post.id] = (status, pool.submit(self.statusComments, post, status))
         for post in postList:
-            #post extraction
-            post_row = pd.DataFrame({'post_id': pd.Series([post.id], dtype='str'),
-                                    'comment_id': pd.Series([], dtype='str'),
-                                    'subreddit': pd.Series([post.subreddit.display_name], dtype='str'),
-                                    'text_type': pd.Series(['post'], dtype='str'),
-                                    'epoch_time': pd.Series([post.created_utc], dtype='int'),
-                                    'text': pd.Series([post.title+post.selftext], dtype='str'),
-                                   'tickers': pd.Series([], dtype='str')})   
-            df = df.append(post_row) 
-            #comments extraction
-            submission = self.reddit.submission(id=post.id)
-            submission.comment_sort = 'best'
-            submission.comment_limit = 5
-            for top_level_comment in submission.comments:
-                if isinstance(top_level_comment, praw.models.MoreComments):
-                    continue                    
-                new_row = pd.DataFrame({'post_id': pd.Series([post.id], dtype='str'),
-                                        'comment_id': pd.Series([top_level_comment.id], dtype='str'),
-                                        'subreddit': pd.Series([top_level_comment.subreddit.display_name], dtype='str'),
-                                        'text_type': pd.Series(['comment'], dtype='str'),
-                                        'epoch_time': pd.Series([top_level_comment.created_utc], dtype='int'),
-                                        'text': pd.Series([top_level_comment.body], dtype='str'),
-                                       'tickers': pd.Series([], dtype='str')})  
-                df = df.append(new_row)  
-                                         
-        return df
-    def joinData(self,subreddits,limit):
+            if post.id not in futures:
+                continue
+            status, comments = futures[post.id]
+            for record in self.freshRecords(post, status, comments.result()):
+                self.addRow(columns, record)
+        if ownPool:
+            pool.shutdown()
+        return columns
 
-        main_df = pd.DataFrame({'post_id': pd.Series([], dtype='str'),
-                'comment_id': pd.Series([], dtype='str'),
-                'subreddit': pd.Series([], dtype='str'),
-                'text_type': pd.Series([], dtype='str'),
-                'epoch_time': pd.Series([], dtype='int'),
-                'text': pd.Series([], dtype='str'),
-                'tickers': pd.Series([], dtype='str')})
-        for subreddit in subreddits:
-            posts_test = self.subredditData(subreddit = subreddit,limit = limit)
+    def subredditDF(self,postList,pool = None):
+        return self.buildFrame(self.subredditRows(postList, self.newColumns(), pool))
+
+    def joinData(self,subreddits,limit):
+        #subreddits are fetched in parallel, their posts share one pool for loading the comments
+        def fetchSubreddit(subreddit):
             start = time.time()
-            df = self.subredditDF(posts_test)
-            end = time.time()
+            posts_test = list(self.subredditData(subreddit = subreddit,limit = limit))
+            columns = self.subredditRows(posts_test, self.newColumns(), commentPool)
+            self.timings[subreddit] = time.time() - start
+            return columns
+        self.timings = {}
+        with ThreadPoolExecutor(max_workers = self.max_workers) as commentPool:
+            with ThreadPoolExecutor(max_workers = max(len(subreddits), 1)) as subredditPool:
+                results = list(subredditPool.map(fetchSubreddit, subreddits))
+        columns = self.newColumns()
+        for subreddit, subredditColumns in zip(subreddits, results):
             print("Elapsed time for subreddit",subreddit)
-            print(end-start)
-            main_df = main_df.append(df)
-        return main_df
+            print(self.timings[subreddit])
+            for column in columns:
+                columns[column].extend(subredditColumns[column])
+        return self.buildFrame(columns)
+
+    def iterRecords(self,subreddits,limit):
+        #yields every post and comment as soon as its comment tree is loaded, instead of building a frame,
+        #at most twice max_workers comment trees are loaded ahead so memory does not grow with the number of posts
+        self.timings = {}
+        with ThreadPoolExecutor(max_workers = self.max_workers) as pool:
+            for subreddit in subreddits:
+                start = time.time()
+                pending = deque()
+                for post in self.subredditData(subreddit = subreddit,limit = limit):
+                    status = self.postStatus(post)
+                    if status == 'done':
+                        continue
+                    pending.append((post, status, pool.submit(self.statusComments, post, status)))
+                    if len(pending) >= 2 * self.max_workers:
+                        post, status, comments = pending.popleft()
+                        yield from self.freshRecords(post, status, comments.result())
+                while pending:
+                    post, status, comments = pending.popleft()
+                    yield from self.freshRecords(post, status, comments.result())
+                self.timings[subreddit] = time.time() - start
+                print("Elapsed time for subreddit",subreddit)
+                print(self.timings[subreddit])
+
+    def itemRecord(self,item): #record of a post or comment coming from a subreddit stream
+        if isinstance(item, praw.models.Submission):
+            return self.record(item.id, None, item.subreddit.display_name, 'post', item.created_utc, item.title+item.selftext)
+        return self.record(item.link_id.split('_', 1)[1], item.id, item.subreddit.display_name, 'comment',
+                           item.created_utc, item.body)
+
+    def streamRecords(self,subreddits,skip_existing = True,max_pause = 16):
+        #endless generator of new posts and comments of the subreddits, polled alternately so neither starves the other,
+        #waits up to max_pause seconds when nothing is new and reconnects after reddit or network errors
+        #requests go through the shared rate limiter, a consumer that stops pulling also stops the polling
+        multireddit = self.getReddit().subreddit('+'.join(subreddits))
+        seen = praw.models.util.BoundedSet(1000) #reconnected streams repeat the latest items
+        pause = 1
+        while True:
+            try:
+                streams = [multireddit.stream.submissions(pause_after = -1, skip_existing = skip_existing),
+                           multireddit.stream.comments(pause_after = -1, skip_existing = skip_existing)]
+                while True:
+                    found = False
+                    for stream in streams:
+                        for item in stream:
+                            if item is None: #end of one response
+                                break
+                            if item.fullname in seen:
+                                continue
+                            seen.add(item.fullname)
+                            found = True
+                            yield self.itemRecord(item)
+                    if found:
+                        pause = 1
+                    else:
+                        time.sleep(pause)
+                        pause = min(2 * pause, max_pause)
+            except (prawcore.exceptions.ResponseException, prawcore.exceptions.RequestException) as error:
+                print("Stream interrupted:", error)
+                time.sleep(pause)
+                pause = min(2 * pause, max_pause)
+                skip_existing = False #catch up on what was posted in the meantime
+
+
+#splits a combined "(...)|(...)" dictionary value into its top level alternatives
+def splitAlternatives(pattern):
+    alternatives = []
+    depth = 0
+    inClass = False
+    start = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if inClass:
+            if c == ']':
+                inClass = False
+        elif c == '[':
+            inClass = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            alternatives.append(pattern[start:i])
+            start = i + 1
+        i += 1
+    alternatives.append(pattern[start:])
+    return [unwrapGroup(a) for a in alternatives]
+
+#removes one pair of parentheses if it wraps the whole alternative
+def unwrapGroup(alternative):
+    if not (alternative.startswith('(') and alternative.endswith(')')) or alternative.startswith('(?'):
+        return alternative
+    depth = 0
+    i = 0
+    while i < len(alternative):
+        c = alternative[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0 and i < len(alternative) - 1:
+                return alternative #the opening bracket closes before the end
+        i += 1
+    return alternative[1:-1]
+
+#returns the literal text every match of the alternative has to start with ('' if there is none)
+def literalPrefix(alternative):
+    return scanLiteral(alternative)[0]
+
+#returns the literal prefix and the position in the alternative where it ends
+def scanLiteral(alternative):
+    i = 0
+    while alternative.startswith('\\b', i):
+        i += 2
+    if i == 0:
+        return '', 0 #without a leading word boundary we cannot anchor the alternative to word starts
+    prefix = ''
+    while i < len(alternative):
+        c = alternative[i]
+        if c == '\\':
+            if i + 1 >= len(alternative) or alternative[i+1].isalnum():
+                break #\b, \w, \d, backreferences...
+            literal = alternative[i+1]
+            step = 2
+        elif c in '.^$*+?{}[]|()':
+            break
+        else:
+            literal = c
+            step = 1
+        if alternative[i+step:i+step+1] in ('*', '+', '?', '{'):
+            break #the character is quantified, so it is not guaranteed to be there
+        prefix += literal
+        i += step
+    if re.match(r'\w', prefix[:1]) is None:
+        return '', 0
+    return prefix, i
+
+#for an alternative that is a plain ascii word, optionally followed by a word boundary, returns
+#[ends with a word boundary, length of the word], the prefix found at a word start then decides the match without a regex
+def literalTail(alternative):
+    prefix, end = scanLiteral(alternative)
+    tail = alternative[end:]
+    if prefix and prefix.isascii() and tail in ('', '\\b'):
+        return [tail == '\\b', len(prefix)]
+    return None
+
+def isWord(text, i):
+    return 0 <= i < len(text) and WORD.match(text, i) is not None
+
+WORD = re.compile(r'\w')
+
+#builds a regex matching the longest of the given words, factored as a trie so that the regex engine
+#walks one branch per character instead of trying every word in turn
+def trieRegex(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = {} #end of a word
+    def build(node):
+        branches = [re.escape(c) + build(child) for c, child in sorted(node.items()) if c != '']
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            return '(?:' + body + ')?' #a word may end here, greedy so the longest word wins
+        return body
+    return build(trie)
+
+#compiled once from the stock dictionary, finds every ticker of a text in a single pass
+#each alternative is indexed by the literal text it starts with, the text is scanned once for
+#word starts beginning with any of these prefixes and only the alternatives sharing the prefix are tried there
+#alternatives that are just a word (most aliases) are decided by the prefix alone, so adding aliases does not add regexes to run
+class Ticker_Matcher:
+    SPEC_VERSION = 2 #increase when the format of spec() changes
+
+    def __init__(self, stockDict):
+        anchored = {}
+        unanchored = []
+        self.keys = list(stockDict)
+        for k, key in enumerate(self.keys):
+            for i, alternative in enumerate(splitAlternatives(stockDict[key])): #i decides between alternatives matching at one offset
+                if re.match(r'(\\b)+\$\w', alternative):
+                    continue #"$" is an end anchor here, such an alternative can never match
+                prefix = literalPrefix(alternative)
+                if prefix:
+                    anchored.setdefault(prefix.casefold(), []).append([k, i, alternative, literalTail(alternative)])
+                else:
+                    unanchored.append([k, i, alternative])
+        #the longest prefix starting at a word is captured, shorter ones are looked up from it
+        self.load(anchored, unanchored, r'\b(?=(' + trieRegex(anchored) + '))')
+
+    def load(self, anchored, unanchored, trigger):
+        self.source = {'anchored': anchored, 'unanchored': unanchored, 'trigger': trigger}
+        self.anchored = {} #casefolded prefix -> [(key index, alternative index, compiled alternative or None for plain words, literalTail)]
+        for prefix, alternatives in anchored.items():
+            self.anchored[prefix] = [(k, i, None if tail is not None else re.compile(alternative, re.IGNORECASE), tail)
+                                     for k, i, alternative, tail in alternatives]
+        self.unanchored = [(k, i, re.compile(alternative, re.IGNORECASE)) for k, i, alternative in unanchored] #searched over the whole text
+        self.trigger = re.compile(trigger, re.IGNORECASE)
+
+    def spec(self): #json serializable form, loaded again by fromSpec without analysing the dictionary
+        return dict(self.source, version = self.SPEC_VERSION, keys = self.keys)
+
+    @classmethod
+    def fromSpec(cls, spec):
+        if spec.get('version') != cls.SPEC_VERSION:
+            raise ValueError("Matcher spec version " + str(spec.get('version')) + " cannot be loaded, rebuild it")
+        matcher = cls.__new__(cls)
+        matcher.keys = list(spec['keys'])
+        matcher.load(spec['anchored'], spec['unanchored'], spec['trigger'])
+        return matcher
+
+    def matchEnd(self, compiled, tail, postText, start, prefix): #end of the alternative matched at start, None without a match
+        if compiled is None: #a plain word, compare the text and check the boundary after it
+            end = start + tail[1]
+            if postText[start:end].casefold() == prefix and \
+                    (not tail[0] or isWord(postText, end - 1) != isWord(postText, end)):
+                return end
+            return None
+        match = compiled.match(postText, start)
+        return None if match is None else match.end()
+
+    def matchesAt(self, compiled, tail, postText, start, prefix):
+        return self.matchEnd(compiled, tail, postText, start, prefix) is not None
+
+    def findTickers(self, postText):
+        found = set()
+        if self.anchored:
+            for hit in self.trigger.finditer(postText):
+                start = hit.start()
+                matched = hit.group(1).casefold()
+                for length in range(1, len(matched) + 1):
+                    for k, i, compiled, tail in self.anchored.get(matched[:length], ()):
+                        if k not in found and self.matchesAt(compiled, tail, postText, start, matched[:length]):
+                            found.add(k)
+        for k, i, compiled in self.unanchored:
+            if k not in found and compiled.search(postText) is not None:
+                found.add(k)
+        return [self.keys[k] for k in sorted(found)] #keeps the dictionary order
+
+    def findMentions(self, postText):
+        #same pass as findTickers, but keeps going after the first match and returns [(ticker, [offsets])]
+        #the mentions are those re.finditer finds with the ticker's pattern: at each offset the first matching alternative
+        #is taken and the next mention starts after its end, so S&P500 or AT&T are one mention of SPGI or T
+        matches = {} #key index -> {offset: (alternative index, end)}
+        def add(k, i, start, end):
+            at = matches.setdefault(k, {})
+            if start not in at or i < at[start][0]:
+                at[start] = (i, end)
+        if self.anchored:
+            for hit in self.trigger.finditer(postText):
+                start = hit.start()
+                matched = hit.group(1).casefold()
+                for length in range(1, len(matched) + 1):
+                    for k, i, compiled, tail in self.anchored.get(matched[:length], ()):
+                        end = self.matchEnd(compiled, tail, postText, start, matched[:length])
+                        if end is not None:
+                            add(k, i, start, end)
+        for k, i, compiled in self.unanchored:
+            match = compiled.search(postText)
+            while match is not None: #every offset, the matches of other alternatives may end in between
+                add(k, i, match.start(), match.end())
+                match = compiled.search(postText, match.start() + 1)
+        mentions = []
+        for k in sorted(matches):
+            offsets, end = [], 0
+            for start in sorted(matches[k]):
+                if start >= end:
+                    offsets.append(start)
+                    end = max(matches[k][start][1], start + 1)
+            mentions.append((self.keys[k], offsets))
+        return mentions
 
 
 #searches text for ticker mentions defined in our stock dictionary 
 class Ticker_Extractor:
-    def __init__(self,dict):
+    def __init__(self,dict,matcher = None): #matcher is a saved Ticker_Matcher.spec(), see Stock_Dictionary.get_matcher
         self.stockDict = dict
+        self.matcher = Ticker_Matcher(dict) if matcher is None else Ticker_Matcher.fromSpec(matcher)
     def openDict(self):
         with open('stockDict.json') as json_file: 
             stockDict = json.load(json_file) #
@@ -95,13 +655,45 @@ class Ticker_Extractor:
         pass
     
     def tickerCounter(self, postText): #append number of mentions to dataframe
-        #pattern  = r"(?:\$)?[A-Z][A-Z\d]+"
-        mentionedTickers = []
-        for key in self.stockDict:
-            if re.search(self.stockDict[key],postText,re.IGNORECASE) is not None:
-                mentionedTickers.append(key)
-        mentionedTickers = list(set(mentionedTickers)) #unique values
+        mentionedTickers = self.matcher.findTickers(postText) #unique values, single pass over the text
         if len(mentionedTickers)>0:
             return mentionedTickers
         else:
-            return None
\ No newline at end of file
+            return None
+
+    def mentionCounter(self, postText): #every mention of each ticker, the tickers in the same order as tickerCounter
+        mentions = self.matcher.findMentions(postText)
+        if len(mentions)>0:
+            return [{'ticker': ticker, 'count': len(offsets), 'offsets': offsets} for ticker, offsets in mentions]
+        else:
+            return None
+
+    def tag_batch(self, texts, chunk_size = 10000, mentions = False):
+        #tags a whole text column at once, returns an arrow list<string> column
+        #with mentions, a MENTIONS_TYPE column of the counts and offsets is returned next to it, found in the same pass
+        if isinstance(texts, (pa.Array, pa.ChunkedArray)):
+            texts = texts.to_pylist()
+        else:
+            texts = list(texts) #pandas series or any iterable
+        chunks, mentionChunks = [], []
+        for start in range(0, len(texts), chunk_size):
+            tagged = {} #bot messages and [deleted] repeat a lot, each distinct text is matched once per chunk
+            tickers, found = [], []
+            for text in texts[start:start + chunk_size]:
+                if not isinstance(text, str): #missing text
+                    tickers.append(None)
+                    found.append(None)
+                    continue
+                if text not in tagged:
+                    if mentions:
+                        textMentions = self.mentionCounter(text)
+                        tagged[text] = ([m['ticker'] for m in textMentions] if textMentions else None, textMentions)
+                    else:
+                        tagged[text] = (self.tickerCounter(text), None)
+                tickers.append(tagged[text][0])
+                found.append(tagged[text][1])
+            chunks.append(pa.array(tickers, type = pa.list_(pa.string())))
+            mentionChunks.append(pa.array(found, type = MENTIONS_TYPE))
+        if mentions:
+            return pa.chunked_array(chunks, type = pa.list_(pa.string())), pa.chunked_array(mentionChunks, type = MENTIONS_TYPE)
+        return pa.chunked_array(chunks, type = pa.list_(pa.string()))
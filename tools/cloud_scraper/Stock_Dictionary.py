@@ -1,109 +1,174 @@
 import pandas as pd
 import re
 import lxml
+import os
+import json
+import shutil
+import time
+import argparse
 
 #lots of manual work and linear coding here, no need to use OOP 
 
-def get_dict():
-    data = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
-    scrapedSAP = data[0]
-    #removing tickers with length one
-    data = scrapedSAP[scrapedSAP['Symbol'].str.len()>1][["Symbol","Security"]]
-    data = pd.DataFrame(data)
-
-    #populate the dictionary
+#the scraped constituents, the rules and the dictionary and matcher built from them are kept in one json file,
+#so runs start without downloading or compiling anything and the same constituents give the same dictionary
+#the rules live in stock_rules.json, changing them rebuilds the cached dictionary offline on the next run,
+#the cloud scraper is deployed with a copy of them next to its dictionary (written by __main__ with --path),
+#where that file is missing the rules stored in the dictionary are used
+DICT_VERSION = 2 #increase whenever build_dict changes, cached dictionaries of older versions are rebuilt offline
+DICT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stock_dictionary.json')
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stock_rules.json')
+SP500_URL = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
+
+def scrape_constituents():
+    data = pd.read_html(SP500_URL)
+    return data[0][["Symbol","Security"]]
+
+def load_artifact(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as json_file:
+        return json.load(json_file)
+
+def save_artifact(artifact, path):
+    try:
+        with open(path + '.tmp', 'w') as json_file:
+            json.dump(artifact, json_file, indent = 1)
+        os.replace(path + '.tmp', path)
+    except OSError as error: #e.g. read only lambda package, the dictionary is still returned
+        print("Could not cache the stock dictionary:", error)
+
+def refresh(path = DICT_PATH, constituents = None, pinned = False):
+    #scrapes the constituents, or reads them from a csv with Symbol and Security columns, and rebuilds the cache
+    if constituents is None:
+        data = scrape_constituents()
+    else:
+        data = pd.read_csv(constituents)[["Symbol","Security"]]
+    artifact = {'built': time.time(),
+                'pinned': pinned, #pinned constituents never expire, for reproducible runs
+                'constituents': data.values.tolist()}
+    return rebuild(artifact, path)
+
+def rebuild(artifact, path):
+    #builds the dictionary from the cached constituents and the current rules, no download needed
+    data = pd.DataFrame(artifact['constituents'], columns = ["Symbol","Security"])
+    artifact['version'] = DICT_VERSION
+    artifact['rules'] = current_rules(artifact)
+    artifact['dictionary'] = build_dict(data, artifact['rules'])
+    artifact['matcher'] = None #compiled by get_matcher when it is first needed
+    save_artifact(artifact, path)
+    return artifact
+
+def get_artifact(path = DICT_PATH, ttl_days = 7, force = False):
+    #cached constituents younger than ttl_days (None never expires) are used as they are,
+    #when they are too old but cannot be downloaded again, the old ones are used rather than failing
+    artifact = None if force else load_artifact(path)
+    expired = artifact is None or (not artifact.get('pinned') and ttl_days is not None
+                                   and time.time() - artifact['built'] > ttl_days * 86400)
+    if expired:
+        try:
+            return refresh(path)
+        except Exception as error:
+            if artifact is None:
+                raise
+            print("Using the cached stock dictionary, refreshing failed:", error)
+    if artifact['version'] != DICT_VERSION or artifact.get('rules') != current_rules(artifact):
+        artifact = rebuild(artifact, path)
+    return artifact
+
+def get_dict(path = DICT_PATH, ttl_days = 7, refresh = False):
+    return get_artifact(path, ttl_days, force = refresh)['dictionary']
+
+def get_matcher(path = DICT_PATH, ttl_days = 7):
+    #the Ticker_Matcher of the cached dictionary in its saved form, pass it to Ticker_Extractor next to the dictionary
+    return artifact_matcher(get_artifact(path, ttl_days), path)
+
+def get_dict_matcher(path = DICT_PATH, ttl_days = 7):
+    #the dictionary and its matcher from one look at the cache, so an expired or missing cache is scraped only once
+    artifact = get_artifact(path, ttl_days)
+    return artifact['dictionary'], artifact_matcher(artifact, path)
+
+def artifact_matcher(artifact, path):
+    try:
+        from tools.Extractor import Ticker_Matcher
+    except ImportError: #cloud_scraper, where the modules sit next to each other
+        from Extractor import Ticker_Matcher
+    matcher = artifact.get('matcher')
+    if matcher is None or matcher['version'] != Ticker_Matcher.SPEC_VERSION:
+        artifact['matcher'] = Ticker_Matcher(artifact['dictionary']).spec()
+        save_artifact(artifact, path)
+    return artifact['matcher']
+
+def get_acro_list(path = DICT_PATH, ttl_days = 7):
+    #all S&P 500 tickers in the yahoo format
+    return [symbol.replace('.', '-') for symbol, security in get_artifact(path, ttl_days)['constituents']]
+
+def load_rules(path = RULES_PATH):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+def current_rules(artifact):
+    #the rules of stock_rules.json, or where there is no such file (the lambda package) those the artifact was built with
+    if os.path.exists(RULES_PATH):
+        return load_rules()
+    if 'rules' not in artifact:
+        raise FileNotFoundError("No " + RULES_PATH + " and no rules in the stock dictionary, build both with "
+                                "python -m tools.Stock_Dictionary --path tools/cloud_scraper/stock_dictionary.json")
+    return artifact['rules']
+
+def build_dict(scrapedSAP, rules = None):
+    #applies the rules of stock_rules.json to the constituents, see the keys of that file for what each step does
+    rules = load_rules() if rules is None else rules
+    data = scrapedSAP[scrapedSAP['Symbol'].str.len() >= rules['min_ticker_length']]
+
+    #populate the dictionary, every ticker starts with itself and the company name
     stockDict = dict()
-    for i,r in data.iterrows():
-        ticker = r[0]
-        full_name = r[1]
+    for ticker, full_name in data[["Symbol","Security"]].values:
         stockDict[ticker] = [ticker,full_name]
-
-    #expand possibilities for selected indexes
-    stockDict['SPGI'][1] = 'S&P'
-    stockDict['SPGI'].append("S&P500")
-    stockDict['NDAQ'].append("NASDAQ100")
-    stockDict['DOW'].append("DJIA")
-    stockDict['DOW'].append("DJI")
-    stockDict['ARKK'] = ['ARKK','ARK Innovation'] #because ark funds are popular nowadays
-    #manually remove stocks which have tickers similar to common english words or could likely be matched by mistake
-    stockDict.pop('ARE')
-    stockDict.pop('ALL')
-    stockDict.pop('CAT')
-    stockDict.pop('COST')
-    stockDict.pop('DD') #due diligence
-    stockDict.pop('FAST')
-    stockDict.pop('IT')
-    stockDict.pop('PEAK')
-    stockDict.pop('WELL')
-    stockDict.pop('HAS')
-    stockDict.pop('MA') #jack ma from alibaba
-    stockDict.pop('MET')
-    stockDict.pop('RE') #you're
-    stockDict.pop('INFO')
-    stockDict.pop('KEY')
-    stockDict.pop('KEYS')
-    stockDict.pop('LOW')
-    stockDict.pop('TAP')
-    stockDict.pop('POOL')
-    stockDict.pop('NOW')
-    stockDict.pop('SO')
-    stockDict.pop('SEE')
-    stockDict.pop('MAR')
-    stockDict.pop('GOOG')
-    stockDict['TGT'] = [stockDict['TGT'][0]] #no full word "target", often used in context of a price target
-
-
-    #expand on some commonly used names
-    stockDict['GOOGL'].append('alphabet')
-    stockDict['GOOGL'].append('google')
-    stockDict['BRK.B'].append('berkshire')
-
-
-    #remove unwanted suffixes from the tickers
-
-    unwantedSuffix = [' & Co\.$',
-                    ' Co\. Inc\.',
-                    ' Co\.$',
-                    ' Company$',
-                    ' Ltd$',
-                    ' Ltd\.$',
-                    ', Inc.$',
-                    ' Inc\.$',
-                    ' Inc$',
-                    ' Corp\.$',
-                    ' Corp$',
-                    ' Inc$',
-                    ' Co$',
-                    ' Corporation$',
-                    "\.com$"]
-
+    for ticker, full_name in rules['extra'].items():
+        stockDict[ticker] = [ticker,full_name]
+    for ticker, full_name in rules['names'].items():
+        if ticker in stockDict:
+            stockDict[ticker][1] = full_name
+    for ticker in rules['exclude']:
+        stockDict.pop(ticker, None)
+    for ticker in rules['ticker_only']:
+        if ticker in stockDict:
+            stockDict[ticker] = [ticker]
+    for ticker, aliases in rules['aliases'].items():
+        if ticker in stockDict:
+            stockDict[ticker].extend(aliases)
+
+    #remove unwanted suffixes from the company names
     for key in stockDict:
-        if key != "TGT":
-            for j in unwantedSuffix:
-                name = stockDict[key][1]
-                stockDict[key][1] = re.sub(j,'',name)
-
+        if len(stockDict[key]) > 1:
+            for j in rules['strip_suffixes']:
+                stockDict[key][1] = re.sub(j,'',stockDict[key][1])
 
     #make another alternative with $ at start, reddit uses it for better filtering, so its used
-    for key in stockDict:
-        stockDict[key].append('$'+stockDict[key][0])  
+    if rules['dollar_prefix']:
+        for key in stockDict:
+            stockDict[key].append('$'+stockDict[key][0])
 
-
-    #make values into full word matches for re.match()
+    #make values into full word matches for re.match(), unless the rules give a pattern for the value
+    mainDict = {}
     for key in stockDict:
-        values = stockDict[key]
-        newValues=[]
-        for value in values:
-            newValues.append("\\b"+value+"\\b")
-        stockDict[key] = newValues
+        patterns = rules['patterns'].get(key, {})
+        values = [patterns.get(value, "\\b"+value+"\\b") for value in stockDict[key]]
+        mainDict[key] = "(" + ")|(".join(values) + ")"
 
-    #google specifically is used in many .com link, so we only allow an empty space after it for matching
-    stockDict['GOOGL'][3] = '\\bgoogle '
+    return mainDict
 
-    #observe dictionary
-    mainDict = {}
-    for i in stockDict.keys():
-        combined = "(" + ")|(".join(stockDict[i]) + ")"
-        mainDict[i] = combined
 
-    return mainDict
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Rebuild the cached S&P 500 stock dictionary.')
+    parser.add_argument('--path', default = DICT_PATH, help = 'e.g. tools/cloud_scraper/stock_dictionary.json to deploy it with the lambda, '
+                        'the rules are copied next to it')
+    parser.add_argument('--constituents', default = None, help = 'csv with Symbol and Security columns used instead of Wikipedia')
+    parser.add_argument('--pin', action = 'store_true', help = 'never expire these constituents')
+    args = parser.parse_args()
+    artifact = refresh(args.path, args.constituents, args.pin)
+    get_matcher(args.path)
+    rules_copy = os.path.join(os.path.dirname(os.path.abspath(args.path)), os.path.basename(RULES_PATH))
+    if rules_copy != RULES_PATH: #packaged with the dictionary, so the lambda can rebuild it when it has to
+        shutil.copyfile(RULES_PATH, rules_copy)
+    print("Cached", len(artifact['dictionary']), "tickers of", len(artifact['constituents']), "constituents in", args.path)
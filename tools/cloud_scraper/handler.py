@@ -1,8 +1,9 @@
 import json
 from datetime import date
 import boto3
-from Extractor import Reddit_Extractor, Ticker_Extractor
-from Stock_Dictionary import get_dict
+import pandas as pd
+from Extractor import Reddit_Extractor, Ticker_Extractor, Comment_Budget, Scrape_State
+from Stock_Dictionary import get_dict_matcher
 
 def dailyScraper(event, context):
 
@@ -15,15 +16,27 @@ def dailyScraper(event, context):
     creds = json.loads(s3_meta)
 
 
-    extr = Reddit_Extractor(creds)
-    stock_dictionary = get_dict()
-    tickerExtr = Ticker_Extractor(stock_dictionary)
+    #deeper comment trees are opt-in through the event input, e.g. {"comment_depth": 3, "comment_limit": 100}
+    #MoreComments are then expanded only while the lambda has time left, the last minutes are kept for tagging and upload
+    budget = None
+    if event.get('comment_depth'):
+        budget = Comment_Budget(seconds = context.get_remaining_time_in_millis() / 1000 - event.get('reserve_seconds', 180),
+                                requests = event.get('more_requests'))
+    extr = Reddit_Extractor(creds, comment_limit = event.get('comment_limit', 5), comment_depth = event.get('comment_depth', 0),
+                            max_comments = event.get('max_comments'), comment_budget = budget,
+                            state = None if event.get('full') else Scrape_State('s3://reddit-temp/state/scrape_state.json'))
+    #the dictionary and rules deployed with the function (stock_dictionary.json and stock_rules.json next to this file,
+    #see the README), used however old they are
+    stock_dictionary, matcher = get_dict_matcher(ttl_days = None)
+    tickerExtr = Ticker_Extractor(stock_dictionary, matcher)
     subreddits = ["stocks","investing","StockMarket","wallstreetbets"]
 
 
     #load posts
     main_df = extr.joinData(subreddits = subreddits,limit = 100)
-    main_df['tickers'] = main_df['text'].apply(tickerExtr.tickerCounter)
+    tickers, mentions = tickerExtr.tag_batch(main_df['text'], mentions = True)
+    main_df['tickers'] = tickers.to_pylist()
+    main_df['mentions'] = mentions.to_pylist() #how often and where each ticker is mentioned
 
     #observe dataframe
     vals = main_df['subreddit'].value_counts()
@@ -34,7 +47,14 @@ def dailyScraper(event, context):
 
     path_parq = "s3://reddit-temp/reddit-temp/" + stringEpoch + ".csv"
 
+    if extr.state is not None: #a second run on the same day has only the rows the first did not store, add them to its file
+        try:
+            main_df = pd.concat([pd.read_csv(path_parq), main_df], ignore_index = True)
+        except FileNotFoundError: #first run of the day
+            pass
     main_df.to_csv(path_parq, index=False)
+    if extr.state is not None: #posts and comments of this run are skipped by the next one, only once they are stored
+        extr.state.save()
 
 
     #path_parq = "s3://reddit-temp/parq-data/" + stringEpoch + ".parquet.gzip"